@@ -0,0 +1,239 @@
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, fields
+from pathlib import Path
+from typing import Callable, Optional
+
+import numpy as np
+
+from signwriting_evaluation.metrics.base import SignWritingMetric
+from signwriting_evaluation.metrics.registry import METRICS, get_metric
+
+try:
+    import resource
+except ImportError:  # not available on Windows, where peak memory is not reported
+    resource = None
+
+CURRENT_DIR = Path(__file__).parent
+
+# Operations scoring the full grid of a corpus (size squared pairs), while the others score aligned pairs (size)
+GRID_OPERATIONS = ["score_all", "score_self"]
+
+
+@dataclass
+class BenchmarkCase:
+    metric: str
+    operation: str
+    size: int
+    signs_per_sentence: Optional[int]  # None when sampling a corpus file
+    symbols_per_sign: Optional[int]
+    corpus_file: Optional[str] = None
+    seed: int = 0
+
+
+def generate_sign(rng: random.Random, num_symbols: int) -> str:
+    # A random FSW sign, whose symbols are placed around the center of the sign box
+    symbols = [f"S{rng.randrange(0x100, 0x38c):03x}{rng.randrange(6)}{rng.randrange(16):x}"
+               for _ in range(num_symbols)]
+    positions = [(rng.randrange(450, 530), rng.randrange(450, 530)) for _ in range(num_symbols)]
+    box_x = max((x for x, _ in positions), default=480) + 20
+    box_y = max((y for _, y in positions), default=480) + 20
+    return f"M{box_x}x{box_y}" + "".join(f"{symbol}{x}x{y}" for symbol, (x, y) in zip(symbols, positions))
+
+
+def generate_corpus(size: int, signs_per_sentence: int, symbols_per_sign: int, seed=0) -> list[str]:
+    rng = random.Random(seed)
+    return [" ".join(generate_sign(rng, symbols_per_sign) for _ in range(signs_per_sentence)) for _ in range(size)]
+
+
+def sample_corpus(corpus_file: str, size: int, seed=0) -> list[str]:
+    # Lines sampled from a file of FSW texts (e.g. assets/single_signs.txt), with repetition if it is too short
+    with open(corpus_file, 'r', encoding='utf-8') as corpus_f:
+        lines = [line for line in corpus_f.read().splitlines() if line]
+    rng = random.Random(seed)
+    return rng.sample(lines, size) if size <= len(lines) else rng.choices(lines, k=size)
+
+
+def case_corpus(case: BenchmarkCase, seed: int) -> list[str]:
+    if case.corpus_file is not None:
+        return sample_corpus(case.corpus_file, case.size, seed)
+    return generate_corpus(case.size, case.signs_per_sentence, case.symbols_per_sign, seed)
+
+
+def benchmark_score(metric: SignWritingMetric, hypotheses: list[str], references: list[str]) -> int:
+    for hypothesis, reference in zip(hypotheses, references):
+        metric.score(hypothesis, reference)
+    return len(hypotheses)
+
+
+def benchmark_score_all(metric: SignWritingMetric, hypotheses: list[str], references: list[str]) -> int:
+    metric.score_all(hypotheses, references, progress_bar=False)
+    return len(hypotheses) * len(references)
+
+
+def benchmark_score_self(metric: SignWritingMetric, hypotheses: list[str], _references: list[str]) -> int:
+    metric.score_self(hypotheses, progress_bar=False)
+    return len(hypotheses) ** 2
+
+
+def benchmark_corpus_score(metric: SignWritingMetric, hypotheses: list[str], references: list[str]) -> int:
+    metric.corpus_score(hypotheses, [references])
+    return len(hypotheses)
+
+
+# Each operation runs on a corpus of hypotheses and one of references, returning the number of pairs it scored
+OPERATIONS: dict[str, Callable[[SignWritingMetric, list[str], list[str]], int]] = {
+    "score": benchmark_score,
+    "score_all": benchmark_score_all,
+    "score_self": benchmark_score_self,
+    "corpus_score": benchmark_corpus_score,
+}
+
+
+def peak_rss_mb() -> Optional[float]:
+    # Peak resident memory of the current process (reported in kilobytes on Linux, and in bytes on macOS)
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+def run_case(case: BenchmarkCase) -> dict:
+    # Times one operation on a new metric instance, in a new process (so that peak memory is its own)
+    hypotheses = case_corpus(case, seed=case.seed)
+    references = case_corpus(case, seed=case.seed + 1)
+
+    metric = get_metric(case.metric)
+    # The first call initializes module-level tables, and instance caches are then cleared, to time cold caches
+    metric.score(hypotheses[0], references[0])
+    metric.clear_caches()
+    setup_peak_rss_mb = peak_rss_mb()
+
+    start = time.perf_counter()
+    pairs = OPERATIONS[case.operation](metric, hypotheses, references)
+    seconds = time.perf_counter() - start
+
+    return {
+        **asdict(case),
+        "pairs": pairs,
+        "seconds": seconds,
+        "pairs_per_second": pairs / seconds if seconds > 0 else None,
+        "setup_peak_rss_mb": setup_peak_rss_mb,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def run_case_in_process(case: BenchmarkCase) -> dict:
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        try:
+            return executor.submit(run_case, case).result()
+        except Exception as error:  # pylint: disable=broad-exception-caught
+            # A failing metric (e.g. CLIP without its model) is reported, and does not stop the benchmark
+            return {**asdict(case), "error": repr(error)}
+
+
+def benchmark_cases(args: argparse.Namespace) -> list[BenchmarkCase]:
+    # Every metric and operation, on every corpus shape (or sampled corpus file) and size of the arguments
+    corpus_shapes = [(None, None)] if args.corpus_file is not None else \
+        list(itertools.product(args.signs_per_sentence, args.symbols_per_sign))
+    cases = []
+    for metric, operation, (num_signs, num_symbols) in itertools.product(args.metrics, args.operations, corpus_shapes):
+        for size in args.grid_sizes if operation in GRID_OPERATIONS else args.sizes:
+            cases.append(BenchmarkCase(metric, operation, size, num_signs, num_symbols, args.corpus_file, args.seed))
+    return cases
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=CURRENT_DIR, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment_info() -> dict:
+    return {
+        "commit": git_commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def case_key(result: dict) -> tuple:
+    return tuple(result[field.name] for field in fields(BenchmarkCase))
+
+
+def format_result(result: dict) -> str:
+    name = f"{result['metric']}.{result['operation']}(size={result['size']}, " \
+           f"signs={result['signs_per_sentence']}, symbols={result['symbols_per_sign']})"
+    if "error" in result:
+        return f"{name}: {result['error']}"
+    peak = f"{result['peak_rss_mb']:.0f} MB" if result["peak_rss_mb"] is not None else "unknown"
+    # Throughput is unknown (None) when the timer measured no time
+    throughput = f"{result['pairs_per_second']:,.0f}" if result["pairs_per_second"] is not None else "n/a"
+    return f"{name}: {throughput} pairs/sec, {result['seconds']:.3f}s, peak RSS {peak}"
+
+
+def compare_results(baseline: dict, results: dict):
+    # Prints the throughput of each case relative to the same case in a baseline (e.g. the previous commit)
+    baseline_results = {case_key(result): result for result in baseline["results"] if "error" not in result}
+    print(f"Compared to {baseline['environment'].get('commit')}:")
+    for result in results["results"]:
+        previous = baseline_results.get(case_key(result))
+        if previous is None or "error" in result:
+            continue
+        if result["pairs_per_second"] is None or previous["pairs_per_second"] is None:
+            print(f"{'n/a':>7} {format_result(result)}")
+            continue
+        speedup = result["pairs_per_second"] / previous["pairs_per_second"]
+        print(f"{speedup:6.2f}x {format_result(result)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the throughput and memory of SignWriting metrics")
+    parser.add_argument("--metrics", nargs="+", default=list(METRICS), choices=list(METRICS))
+    parser.add_argument("--operations", nargs="+", default=list(OPERATIONS), choices=list(OPERATIONS))
+    parser.add_argument("--sizes", nargs="+", type=int, default=[1000, 10000],
+                        help="Corpus sizes for score and corpus_score (number of pairs)")
+    parser.add_argument("--grid-sizes", nargs="+", type=int, default=[100, 300],
+                        help="Corpus sizes for score_all and score_self (number of pairs is the size squared)")
+    parser.add_argument("--signs-per-sentence", nargs="+", type=int, default=[1, 3])
+    parser.add_argument("--symbols-per-sign", nargs="+", type=int, default=[4])
+    parser.add_argument("--corpus-file", help="Sample FSW lines from this file, instead of generating signs")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark.json", help="JSON file to save the results to")
+    parser.add_argument("--baseline", help="JSON results of a previous run, to compare against")
+    args = parser.parse_args()
+
+    cases = benchmark_cases(args)
+    results = {"environment": environment_info(), "results": []}
+    for case in cases:
+        result = run_case_in_process(case)
+        print(format_result(result), flush=True)
+        results["results"].append(result)
+
+        # Saved after each case, so that the results of a long run are kept if it is interrupted
+        with open(args.output, 'w', encoding='utf-8') as output_f:
+            json.dump(results, output_f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline, 'r', encoding='utf-8') as baseline_f:
+            compare_results(json.load(baseline_f), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,30 @@
 from pathlib import Path
 
-import matplotlib.pyplot as plt
 import numpy as np
 
-from signwriting.visualizer.visualize import signwriting_to_image
 from signwriting_evaluation.metrics.base import SignWritingMetric
-from signwriting_evaluation.metrics.bleu import SignWritingBLEU
-from signwriting_evaluation.metrics.chrf import SignWritingCHRF
-from signwriting_evaluation.metrics.clip import SignWritingCLIPScore
-from signwriting_evaluation.metrics.similarity import SignWritingSimilarityMetric
+from signwriting_evaluation.metrics.evaluator import MultiMetricEvaluator
+from signwriting_evaluation.metrics.registry import get_metric
 
 CURRENT_DIR = Path(__file__).parent
 ASSETS_DIR = CURRENT_DIR.parent.parent / "assets"
 
 
-# Set the font to Times Roman
-plt.rcParams['font.family'] = 'Times New Roman'
-plt.rcParams['font.serif'] = ['Times New Roman'] + plt.rcParams['font.serif']
-# increase font size
-plt.rcParams.update({'font.size': 14})
+def load_pyplot():
+    # matplotlib is imported and configured only when plotting
+    import matplotlib.pyplot as plt  # pylint: disable=import-outside-toplevel
+
+    # Set the font to Times Roman
+    plt.rcParams['font.family'] = 'Times New Roman'
+    plt.rcParams['font.serif'] = ['Times New Roman'] + plt.rcParams['font.serif']
+    # increase font size
+    plt.rcParams.update({'font.size': 14})
+    return plt
+
+
+def save_sign_image(fsw: str, path: Path):
+    from signwriting.visualizer.visualize import signwriting_to_image  # pylint: disable=import-outside-toplevel
+    signwriting_to_image(fsw).save(path)
 
 
 def load_signs(signs_file: Path):
@@ -33,38 +39,41 @@ def find_closest_signs(signs: list[str], all_signs: list[str], metrics: list[Sig
 
     for metric in metrics:
         print(f"Computing {metric.name}")
-        all_scores = metric.score_all(signs, all_signs)
+        all_indices, all_scores = metric.top_k(signs, all_signs, k=11)
 
-        for specific_sign, scores in zip(signs, all_scores):
+        for specific_sign, top_k in zip(signs, zip(all_indices, all_scores)):
             sign_dir = matches_dir / specific_sign
             sign_dir.mkdir(parents=True, exist_ok=True)
-            signwriting_to_image(specific_sign).save(sign_dir / "ref.png")
+            save_sign_image(specific_sign, sign_dir / "ref.png")
 
             metric_dir = sign_dir / metric.name
             metric_dir.mkdir(parents=True, exist_ok=True)
 
-            closest_signs = sorted(zip(all_signs, scores), key=lambda x: x[1], reverse=True)[1:11]
+            closest_signs = [(all_signs[i], score) for i, score in zip(*top_k)][1:]  # skip the sign itself
             print("Closest signs:")
             for i, (sign, score) in enumerate(closest_signs):
                 print(f"{score}: {sign}")
-                signwriting_to_image(sign).save(metric_dir / f"{i}.png")
+                save_sign_image(sign, metric_dir / f"{i}.png")
 
 
 def metrics_distribution(signs: list[str], metrics: list[SignWritingMetric]):
-    distribution_dir = ASSETS_DIR / "distribution"
-    distribution_dir.mkdir(parents=True, exist_ok=True)
-
     signs_subset = signs[:1000]
 
+    print(f"Computing {', '.join(metric.name for metric in metrics)}")
+    all_scores = MultiMetricEvaluator(metrics).score_all(signs_subset, signs_subset)
+
     metric_scores = {}
+    for metric_name, scores in all_scores.items():
+        scores = scores.flatten()
+        metric_scores[metric_name] = scores[scores < 0.999]  # Remove self scores
 
-    for metric in metrics:
-        print(f"Computing {metric.name}")
-        all_scores = metric.score_all(signs_subset, signs_subset)
+    plot_distributions(metric_scores)
 
-        scores = np.array(all_scores).flatten()
-        scores = scores[scores < 0.999]  # Remove self scores
-        metric_scores[metric.name] = scores
+
+def plot_distributions(metric_scores: dict[str, np.ndarray]):
+    plt = load_pyplot()
+    distribution_dir = ASSETS_DIR / "distribution"
+    distribution_dir.mkdir(parents=True, exist_ok=True)
 
     for metric_name, scores in metric_scores.items():
         mean, std = np.mean(scores), np.std(scores)
@@ -95,12 +104,7 @@ if __name__ == "__main__":
     hello_signs = load_signs(ASSETS_DIR / "hello_signs.txt")
     print(f"Found {len(single_signs)} signs")
 
-    all_metrics = [
-        SignWritingCLIPScore(),
-        SignWritingSimilarityMetric(),
-        SignWritingBLEU(),
-        SignWritingCHRF(),
-    ]
+    all_metrics = [get_metric(name) for name in ["clip", "similarity", "bleu", "chrf"]]
 
     metrics_distribution(single_signs, all_metrics)
 
@@ -1,9 +1,41 @@
+import hashlib
+import heapq
 import itertools
-from typing import Sequence
+import json
+import math
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager, nullcontext
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Sequence, Optional, TextIO, Union
 
 import numpy as np
 from tqdm import tqdm
 
+from signwriting_evaluation.metrics.parsed import SignWritingInput, signwriting_text
+
+# Blocks of rows, the work units of score_self and parallel execution:
+# more blocks balance the load between processes (and waste less of the symmetric triangle),
+# while larger blocks reduce the overhead. Each block is bounded in memory by its number of cells.
+MIN_ROW_BLOCKS = 64
+BLOCKS_PER_JOB = 8
+MAX_BLOCK_CELLS = 2 ** 22
+
+# Maximum number of entries in each of a metric's caches (None for unbounded), e.g. the encoding of each text.
+# Calls that score blocks of rows against a whole corpus (score_self, and score_all with n_jobs) grow the caches to
+# the corpus for their duration (see SignWritingMetric.fitted_caches). Other repeated calls on a larger corpus
+# (e.g. score_all of chunks of it) encode the texts evicted since the last call again, unless created with
+# cache_size=None, or with a cache_size at least as large as the corpus
+DEFAULT_CACHE_SIZE = 2 ** 16
+
+STREAM_CHUNK_SIZE = 1000  # Lines of a streamed corpus held in memory at once
+
+# State of each worker process in a parallel execution, set once by init_worker
+WORKER_STATE = {}
+
 
 def validate_corpus_score_input(hypotheses: Sequence[str], references: Sequence[list[str]]):
     # This method is designed to avoid mistakes in the use of the corpus_score method
@@ -20,13 +52,275 @@ def validate_corpus_score_input(hypotheses: Sequence[str], references: Sequence[
              f"must have the same number of instances (references is ({len(references)}))")
 
 
-class SignWritingMetric:
+def cache_report(hits: int, misses: int, maxsize: Optional[int] = None, currsize: Optional[int] = None) -> dict:
+    lookups = hits + misses
+    return {"hits": hits, "misses": misses, "hit_rate": hits / lookups if lookups > 0 else None,
+            "maxsize": maxsize, "currsize": currsize}
+
+
+class Instrumentation:
+    """Time spent in each stage of a metric (with its number of calls), and counters of events.
+    A callback(stage, seconds) can forward each timed stage, e.g. to a monitoring system.
+    It is pickled without its callback, and worker processes record into their own copy."""
+
+    def __init__(self, callback: Optional[Callable[[str, float], None]] = None):
+        self.callback = callback
+        self.seconds: dict[str, float] = defaultdict(float)
+        self.calls: dict[str, int] = defaultdict(int)
+        self.counters: dict[str, int] = defaultdict(int)
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.seconds[name] += seconds
+            self.calls[name] += 1
+            if self.callback is not None:
+                self.callback(name, seconds)
+
+    def count(self, name: str, value: int = 1):
+        self.counters[name] += value
+
+    def report(self) -> dict:
+        stages = {name: {"seconds": seconds, "calls": self.calls[name]} for name, seconds in self.seconds.items()}
+        return {"stages": stages, "counters": dict(self.counters)}
+
+    def __getstate__(self):
+        return {**self.__dict__, "callback": None}
+
+
+# Stage of a metric without instrumentation, shared by all calls
+NO_STAGE = nullcontext()
+
+
+class CachedFunction:
+    """Least-recently-used cache of a function's results, with a bounded size and hit/miss statistics.
+    It is pickled without its contents, so metrics can be sent to worker processes."""
+
+    def __init__(self, function: Callable, maxsize: Optional[int] = DEFAULT_CACHE_SIZE):
+        self.function = function
+        self.maxsize = maxsize
+        self.cached_function = lru_cache(maxsize=maxsize)(function)
+        self.resized_hits = self.resized_misses = 0  # statistics of the caches replaced by resize
+
+    def __call__(self, *args):
+        return self.cached_function(*args)
+
+    def cache_info(self):
+        info = self.cached_function.cache_info()
+        return info._replace(hits=info.hits + self.resized_hits, misses=info.misses + self.resized_misses)
+
+    def cache_clear(self):
+        self.cached_function.cache_clear()
+        self.resized_hits = self.resized_misses = 0
+
+    def resize(self, maxsize: Optional[int]):
+        # A new cache of maxsize entries (lru_cache has no resize), so the current contents are dropped,
+        # while the statistics are kept
+        info = self.cache_info()
+        self.maxsize = maxsize
+        self.cached_function = lru_cache(maxsize=maxsize)(self.function)
+        self.resized_hits, self.resized_misses = info.hits, info.misses
+
+    def __getstate__(self):
+        return {"function": self.function, "maxsize": self.maxsize}
+
+    def __setstate__(self, state: dict):
+        self.__init__(state["function"], state["maxsize"])
+
+
+def init_worker(metric: "SignWritingMetric", hypotheses: Sequence[str], references: Sequence[str]):
+    WORKER_STATE["metric"] = metric
+    WORKER_STATE["hypotheses"] = hypotheses
+    WORKER_STATE["references"] = references
+
+
+def score_worker_block(hyp_start: int, hyp_end: int, ref_start: int) -> np.ndarray:
+    # Scores of hypotheses[hyp_start:hyp_end] against references[ref_start:]
+    metric = WORKER_STATE["metric"]
+    hypotheses = WORKER_STATE["hypotheses"][hyp_start:hyp_end]
+    references = WORKER_STATE["references"][ref_start:]
+    return np.asarray(metric.score_all(hypotheses, references, progress_bar=False, deduplicate=False),
+                      dtype=np.float64)
+
+
+def read_lines(file: Union[str, Path, TextIO]) -> Iterator[str]:
+    # Lines of a text file (a path or an open file), without their line endings, read one at a time
+    if isinstance(file, (str, Path)):
+        with open(file, 'r', encoding='utf-8') as lines_f:
+            yield from read_lines(lines_f)
+        return
+    for line in file:
+        yield line.rstrip("\r\n")
+
+
+def iter_corpus_chunks(hypotheses: Iterable[str], references: Sequence[Iterable[str]],
+                       chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[tuple[list[str], list[list[str]]]]:
+    # Chunks of line-aligned hypotheses and reference streams, each in the format of corpus_score
+    assert isinstance(references, (list, tuple)), "References must be a list or a tuple of reference streams"
+    missing = object()
+    segments = itertools.zip_longest(hypotheses, *references, fillvalue=missing)
+    while chunk := list(itertools.islice(segments, chunk_size)):
+        assert all(line is not missing for segment in chunk for line in segment), \
+            "Hypotheses and references must have the same number of lines"
+        hypotheses_chunk, *references_chunk = (list(lines) for lines in zip(*chunk))
+        yield hypotheses_chunk, references_chunk
+
+
+def chunk_ranges(length: int, chunk_size: int) -> list[range]:
+    return [range(start, min(start + chunk_size, length)) for start in range(0, length, chunk_size)]
+
+
+def row_block_size(num_rows: int, num_cols: int, n_jobs: Optional[int] = 1) -> int:
+    num_blocks = max(MIN_ROW_BLOCKS, resolve_n_jobs(n_jobs) * BLOCKS_PER_JOB)
+    return max(1, min(math.ceil(num_rows / num_blocks), MAX_BLOCK_CELLS // max(num_cols, 1)))
+
+
+def mirror_upper_triangle(scores: np.ndarray, blocks: list[range]):
+    # Copies the upper triangle of a square matrix to the lower triangle, one block of rows at a time
+    for rows in blocks:
+        scores[rows.start:rows.stop, :rows.start] = scores[:rows.start, rows.start:rows.stop].T
+        diagonal_block = scores[rows.start:rows.stop, rows.start:rows.stop]
+        lower = np.tril_indices(len(rows), -1)
+        diagonal_block[lower] = diagonal_block.T[lower]
+
+
+def push_top_k(heap: list[tuple[float, int]], k: int, score: float, index: int):
+    # Keeps the k best (score, -index) entries in a min-heap, preferring lower indices on equal scores
+    # (none for k <= 0)
+    entry = (score, -index)
+    if len(heap) < k:
+        heapq.heappush(heap, entry)
+    elif len(heap) > 0 and entry > heap[0]:
+        heapq.heapreplace(heap, entry)
+
+
+def sorted_top_k(heap: list[tuple[float, int]]) -> tuple[list[int], list[float]]:
+    entries = sorted(heap, reverse=True)
+    return [-index for _, index in entries], [score for score, _ in entries]
+
+
+def array_top_k(scores: np.ndarray, k: int) -> tuple[list[int], list[float]]:
+    # Same as sorted_top_k over all the scores of a row, where only scores as high as the kth score are sorted
+    if len(scores) > k > 0:
+        kth_score = np.partition(scores, len(scores) - k)[len(scores) - k]
+        candidates = np.flatnonzero(scores >= kth_score)
+    else:
+        candidates = np.arange(len(scores))
+    order = np.lexsort((candidates, -scores[candidates]))[:max(k, 0)]
+    return candidates[order].tolist(), scores[candidates[order]].tolist()
+
+
+def resolve_n_jobs(n_jobs: Optional[int]) -> int:
+    # Like joblib, None or negative values count back from the number of CPUs (-1 uses all of them)
+    cpu_count = os.cpu_count() or 1
+    if n_jobs is None:
+        return cpu_count
+    if n_jobs < 0:
+        return max(1, cpu_count + 1 + n_jobs)
+    return max(1, n_jobs)
+
+
+class SignWritingMetric:  # pylint: disable=too-many-public-methods
     """Base class for all metrics."""
 
     SYMMETRIC = False  # If True, the metric is symmetric (score(h, r) == score(r, h))
+    VERSION = 1  # Increased when a change of implementation changes scores, to invalidate persisted scores
 
     def __init__(self, name: str):
         self.name = name
+        self.caches: dict[str, CachedFunction] = {}
+        self.instrumentation: Optional[Instrumentation] = None  # disabled by default
+
+    def configuration(self) -> dict:
+        # Everything the scores depend on (JSON serializable), extended by metrics with settings of their own
+        return {"metric": f"{type(self).__module__}.{type(self).__qualname__}", "version": self.VERSION}
+
+    def configuration_hash(self) -> str:
+        # Persisted scores are only reused by metrics of the same configuration hash (see score_cache)
+        configuration = json.dumps(self.configuration(), sort_keys=True, default=str)
+        return hashlib.sha256(configuration.encode("utf-8")).hexdigest()
+
+    def canonical_text(self, text: SignWritingInput) -> str:
+        # Texts with the same canonical text have the same scores: they are scored once by score_all and
+        # corpus_score, and persisted under it. Metrics that ignore parts of the text (e.g. box positions) extend it
+        return signwriting_text(text)
+
+    def distinct_inputs(self, inputs: Sequence[SignWritingInput]) -> tuple[dict[str, SignWritingInput], list[int]]:
+        # The first input of each distinct canonical text (by text), and the index of each input among them
+        distinct, index, positions = {}, {}, []
+        for text_input in inputs:
+            text = self.canonical_text(text_input)
+            if text not in distinct:
+                distinct[text], index[text] = text_input, len(distinct)
+            positions.append(index[text])
+        return distinct, positions
+
+    def cached(self, function: Callable, maxsize: Optional[int] = DEFAULT_CACHE_SIZE) -> CachedFunction:
+        # Caches are per metric instance, and reported by cache_info under the function name
+        self.caches[function.__name__] = CachedFunction(function, maxsize)
+        return self.caches[function.__name__]
+
+    def cache_info(self) -> dict[str, tuple]:
+        # (hits, misses, maxsize, currsize) of each cache
+        return {name: cached_function.cache_info() for name, cached_function in self.caches.items()}
+
+    def clear_caches(self):
+        for cached_function in self.caches.values():
+            cached_function.cache_clear()
+
+    @contextmanager
+    def fitted_caches(self, size: int):
+        # Grows the bounded caches to at least size entries within the context, to fit a whole corpus, and restores
+        # their configured size when leaving it (dropping their contents both times), so that they stay bounded.
+        # Calls that score blocks of rows against a corpus look up every reference for every block,
+        # which would evict (and encode again) the references of each block if the corpus outgrew the caches
+        resized = {cached_function: cached_function.maxsize for cached_function in self.caches.values()
+                   if cached_function.maxsize is not None and cached_function.maxsize < size}
+        for cached_function in resized:
+            cached_function.resize(size)
+        try:
+            yield self
+        finally:
+            for cached_function, maxsize in resized.items():
+                cached_function.resize(maxsize)
+
+    def enable_instrumentation(self, callback: Optional[Callable[[str, float], None]] = None) -> Instrumentation:
+        # Starts recording the time of each stage, see instrumentation_report
+        self.instrumentation = Instrumentation(callback)
+        return self.instrumentation
+
+    def disable_instrumentation(self):
+        self.instrumentation = None
+
+    def stage(self, name: str):
+        # Context timing a stage of the metric, when instrumentation is enabled (otherwise a shared no-op context)
+        if self.instrumentation is None:
+            return NO_STAGE
+        return self.instrumentation.stage(name)
+
+    def count(self, name: str, value: int = 1):
+        if self.instrumentation is not None:
+            self.instrumentation.count(name, value)
+
+    def instrumentation_report(self) -> dict:
+        # Stages (seconds and calls) and counters recorded since instrumentation was enabled,
+        # with the statistics of each cache (since it was last cleared)
+        report = self.instrumentation.report() if self.instrumentation is not None else {"stages": {}, "counters": {}}
+        report["caches"] = {name: cache_report(info.hits, info.misses, info.maxsize, info.currsize)
+                            for name, info in self.cache_info().items()}
+        return report
+
+    @contextmanager
+    def scoped_caches(self):
+        # Clears the caches when leaving the context, e.g. at the end of an evaluation run
+        try:
+            yield self
+        finally:
+            self.clear_caches()
 
     def __call__(self, hypothesis: str, reference: str) -> float:
         return self.score(hypothesis, reference)
@@ -38,14 +332,67 @@ class SignWritingMetric:
         all_scores = self.score_all([hypothesis], references)
         return max(max(scores) for scores in all_scores)
 
+    def pair_key(self, hypothesis: str, reference: str) -> tuple[str, str]:
+        # The pair of canonical texts, in sorted order for symmetric metrics
+        if self.SYMMETRIC and reference < hypothesis:
+            return reference, hypothesis
+        return hypothesis, reference
+
+    def pair_scores(self, pairs: Sequence[tuple[SignWritingInput, SignWritingInput]]) -> list[float]:
+        # Scores of a list of pairs, where each distinct pair_key is scored once,
+        # by one score_all of each distinct hypothesis against its distinct references
+        texts = [(self.canonical_text(h), self.canonical_text(r)) for h, r in pairs]
+        keys = [self.pair_key(*pair_texts) for pair_texts in texts]
+        hypothesis_inputs, reference_inputs = {}, defaultdict(dict)
+        for (hyp_key, ref_key), pair_texts, pair in zip(keys, texts, pairs):
+            hypothesis, reference = pair if pair_texts == (hyp_key, ref_key) else pair[::-1]
+            hypothesis_inputs.setdefault(hyp_key, hypothesis)
+            reference_inputs[hyp_key].setdefault(ref_key, reference)
+        self.count("deduplicated_pairs", len(pairs) - sum(map(len, reference_inputs.values())))
+
+        scores = {}
+        for hyp_key, references in reference_inputs.items():
+            row = self.score_all([hypothesis_inputs[hyp_key]], list(references.values()), progress_bar=False,
+                                 deduplicate=False)[0]
+            scores.update(zip(((hyp_key, ref_key) for ref_key in references), row))
+        return [scores[key] for key in keys]
+
     def corpus_score(self, hypotheses: Sequence[str], references: Sequence[list[str]]) -> float:
         # Default implementation: average over sentence scores
         # example: hypotheses=["hello"], references=[["hi"], ["hello"]]
         validate_corpus_score_input(hypotheses, references)
-        transpose_references = list(zip(*references))
-        return sum(self.score_max(h, r) for h, r in zip(hypotheses, transpose_references)) / len(hypotheses)
+        return sum(score for score, _ in self.corpus_statistics(hypotheses, references)) / len(hypotheses)
+
+    def corpus_statistics(self, hypotheses: list[str], references: list[list[str]]) -> list[list[float]]:
+        # Sufficient statistics of each segment of a chunk of a corpus, summed over the corpus by stream_corpus_score.
+        # Default implementation: the best sentence score of each hypothesis (as score_max), and a count,
+        # where the distinct pairs of the chunk are scored together
+        segments = list(zip(*references))
+        scores = iter(self.pair_scores([(h, r) for h, segment in zip(hypotheses, segments) for r in segment]))
+        return [[max(itertools.islice(scores, len(segment))), 1] for segment in segments]
+
+    def corpus_score_from_statistics(self, statistics: list[float]) -> float:
+        total, count = statistics
+        return total / count
+
+    def stream_corpus_score(self, hypotheses: Iterable[str], references: Sequence[Iterable[str]],
+                            chunk_size: int = STREAM_CHUNK_SIZE) -> float:
+        # Same as corpus_score, for corpora of any size, read one chunk at a time (in constant memory).
+        # example: stream_corpus_score(read_lines("hypotheses.txt"), [read_lines("references.txt")])
+        statistics = None
+        for hypotheses_chunk, references_chunk in iter_corpus_chunks(hypotheses, references, chunk_size):
+            for segment in self.corpus_statistics(hypotheses_chunk, references_chunk):
+                # Summed in the order of the corpus, so scores are the same as corpus_score
+                statistics = segment if statistics is None else [a + b for a, b in zip(statistics, segment)]
+        assert statistics is not None, "The corpus must not be empty"
+        return self.corpus_score_from_statistics(statistics)
+
+    def score_all(self, hypotheses: Sequence[str], references: Sequence[str], progress_bar=True,
+                  n_jobs: Optional[int] = 1, *, deduplicate=True) -> list[list[float]]:
+        scores = self.dispatch_score_all(hypotheses, references, progress_bar, n_jobs, deduplicate)
+        if scores is not None:
+            return scores.tolist()
 
-    def score_all(self, hypotheses: Sequence[str], references: Sequence[str], progress_bar=True) -> list[list[float]]:
         # Default implementation: call the score function for each hypothesis-reference pair
         total = len(hypotheses) * len(references)
         iterator = itertools.product(hypotheses, references)
@@ -56,23 +403,164 @@ class SignWritingMetric:
         scores = [self.score(h, r) for h, r in iterator]
         return [scores[i:i + len(references)] for i in range(0, total, len(references))]
 
-    def score_self(self, hypotheses: Sequence[str], progress_bar=True) -> list[list[float]]:
-        if not self.SYMMETRIC:
+    def dispatch_score_all(self, hypotheses: Sequence[SignWritingInput], references: Sequence[SignWritingInput],
+                           progress_bar=True, n_jobs: Optional[int] = 1, deduplicate=True) -> Optional[np.ndarray]:
+        # The first step of every score_all implementation: scores of the distinct texts only, or scores of blocks of
+        # rows by worker processes. None when neither applies, and score_all should score the pairs itself
+        if deduplicate:
+            return self.deduplicated_score_all(hypotheses, references, progress_bar, n_jobs)
+        if resolve_n_jobs(n_jobs) > 1:
+            return self.parallel_score_all(hypotheses, references, progress_bar, n_jobs)
+        return None
+
+    def deduplicated_score_all(self, hypotheses: Sequence[SignWritingInput], references: Sequence[SignWritingInput],
+                               progress_bar=True, n_jobs: Optional[int] = 1) -> np.ndarray:
+        # score_all of the distinct canonical texts only (with deduplicate=False), whose scores are then copied
+        hyps, hyp_rows = self.distinct_inputs(hypotheses)
+        refs, ref_columns = self.distinct_inputs(references)
+        self.count("deduplicated_pairs", len(hypotheses) * len(references) - len(hyps) * len(refs))
+
+        if self.SYMMETRIC:
+            scores = self.symmetric_score_all(hyps, refs, progress_bar, n_jobs)
+        else:
+            scores = self.score_grid(list(hyps.values()), list(refs.values()), progress_bar, n_jobs)
+
+        if len(hyps) == len(hypotheses) and len(refs) == len(references):
+            return scores  # no duplicates, in the same order
+        return scores[np.ix_(hyp_rows, ref_columns)]
+
+    def score_grid(self, hypotheses: Sequence[SignWritingInput], references: Sequence[SignWritingInput],
+                   progress_bar=True, n_jobs: Optional[int] = 1) -> np.ndarray:
+        # score_all without deduplication, as a (hypotheses, references) array
+        scores = self.score_all(hypotheses, references, progress_bar, n_jobs, deduplicate=False)
+        return np.asarray(scores).reshape(len(hypotheses), len(references))
+
+    def symmetric_score_all(self, hyps: dict[str, SignWritingInput], refs: dict[str, SignWritingInput],
+                            progress_bar=True, n_jobs: Optional[int] = 1) -> np.ndarray:
+        # Scores of distinct hypotheses and references (by canonical text), where the pairs of texts that are both
+        # hypotheses and references are only scored in one order (as in score_self)
+        hyp_inputs, ref_inputs = list(hyps.values()), list(refs.values())
+        ref_index = {text: j for j, text in enumerate(refs)}
+        shared = [i for i, text in enumerate(hyps) if text in ref_index]
+        if len(shared) <= 1:
+            return self.score_grid(hyp_inputs, ref_inputs, progress_bar, n_jobs)
+
+        shared_columns = [ref_index[text] for text in hyps if text in ref_index]
+        other_rows = sorted(set(range(len(hyps))) - set(shared))
+        other_columns = sorted(set(range(len(refs))) - set(shared_columns))
+        shared_inputs = [hyp_inputs[i] for i in shared]
+
+        scores = np.empty((len(hyps), len(refs)))
+        scores[np.ix_(shared, shared_columns)] = self.triangle_score_all(shared_inputs, progress_bar, n_jobs)
+        if len(other_columns) > 0:
+            other_inputs = [ref_inputs[j] for j in other_columns]
+            scores[np.ix_(shared, other_columns)] = self.score_grid(shared_inputs, other_inputs, progress_bar, n_jobs)
+        if len(other_rows) > 0:
+            scores[other_rows] = self.score_grid([hyp_inputs[i] for i in other_rows], ref_inputs, progress_bar, n_jobs)
+        return scores
+
+    def triangle_score_all(self, texts: Sequence[SignWritingInput], progress_bar=True,
+                           n_jobs: Optional[int] = 1) -> np.ndarray:
+        # Scores of all pairs of texts for a symmetric metric, of which only the upper triangle is scored
+        n = len(texts)
+        scores = np.empty((n, n))
+        blocks = chunk_ranges(n, row_block_size(n, n, n_jobs))
+        with tqdm(total=n * (n + 1) // 2, disable=not progress_bar or n <= 1) as pbar:
+            for rows, block in self.iter_row_blocks(texts, texts, blocks, triangular=True, n_jobs=n_jobs):
+                scores[rows.start:rows.stop, rows.start:] = block
+                pbar.update(sum(n - i for i in rows))
+        mirror_upper_triangle(scores, blocks)
+        return scores
+
+    def top_k(self, queries: Sequence[str], corpus: Sequence[str], k=10,
+              progress_bar=True) -> tuple[list[list[int]], list[list[float]]]:
+        # Returns, for each query, the indices and scores of its k best matches in the corpus (best first).
+        # Default implementation: score the corpus in blocks, keeping the k best of each query in a heap
+        heaps = [[] for _ in queries]
+        blocks = chunk_ranges(len(corpus), max(1, MAX_BLOCK_CELLS // max(len(queries), 1)))
+        for columns in tqdm(blocks, disable=not progress_bar or len(blocks) <= 1):
+            block = self.score_all(queries, corpus[columns.start:columns.stop], progress_bar=False)
+            for heap, scores in zip(heaps, block):
+                for j, score in zip(columns, scores):
+                    push_top_k(heap, k, score, j)
+
+        top = [sorted_top_k(heap) for heap in heaps]
+        return [indices for indices, _ in top], [scores for _, scores in top]
+
+    def score_self(self, hypotheses: Sequence[str], progress_bar=True, n_jobs: Optional[int] = 1, as_array=False,
+                   output_path: Optional[Union[str, Path]] = None) -> Union[list[list[float]], np.ndarray]:
+        # Scores are filled in blocks of rows into a float16 matrix, returned as an array if as_array is set,
+        # or memory-mapped to an .npy file at output_path (which can be re-opened with np.load(mmap_mode="r"))
+        if not self.SYMMETRIC and not as_array and output_path is None:
+            if resolve_n_jobs(n_jobs) > 1:
+                return self.parallel_score_all(hypotheses, hypotheses, progress_bar, n_jobs).tolist()
             return self.score_all(hypotheses, hypotheses, progress_bar)
 
-        # For symmetric metrics, only compute upper triangle to avoid redundant calculations
         n = len(hypotheses)
-        scores = np.eye(n, dtype=np.float16)  # Initialize with diagonal 1
+        if output_path is None:
+            scores = np.empty((n, n), dtype=np.float16)
+        else:
+            scores = np.lib.format.open_memmap(output_path, mode="w+", dtype=np.float16, shape=(n, n))
+
+        # For symmetric metrics, only compute upper triangle to avoid redundant calculations
+        total = n * (n - 1) // 2 if self.SYMMETRIC else n * n
+        blocks = chunk_ranges(n, row_block_size(n, n, n_jobs))
+        with tqdm(total=total, disable=not progress_bar or total <= 1) as pbar:
+            for rows, block in self.iter_row_blocks(hypotheses, hypotheses, blocks, self.SYMMETRIC, n_jobs):
+                if self.SYMMETRIC:
+                    for i in rows:
+                        scores[i, i] = 1  # diagonal
+                        scores[i, i + 1:] = block[i - rows.start, i - rows.start + 1:]
+                    pbar.update(sum(n - 1 - i for i in rows))
+                else:
+                    scores[rows.start:rows.stop] = block
+                    pbar.update(block.size)
+
+        if self.SYMMETRIC:
+            mirror_upper_triangle(scores, blocks)
+
+        if output_path is not None:
+            scores.flush()
+            return scores
+        return scores if as_array else scores.tolist()
+
+    def iter_row_blocks(self, hypotheses: Sequence[str], references: Sequence[str], blocks: list[range],
+                        triangular=False, n_jobs: Optional[int] = 1) -> Iterator[tuple[range, np.ndarray]]:
+        # Scores each block of hypotheses rows against the references (from rows.start onward if triangular),
+        # yielding (rows, scores). With multiple jobs, blocks are scored by worker processes, in completion order.
+        # The caches fit all texts while blocks are scored (in the workers too, which receive the metric with them)
+        num_texts = len(hypotheses) if hypotheses is references else len(hypotheses) + len(references)
+        with self.fitted_caches(num_texts):
+            if resolve_n_jobs(n_jobs) == 1:
+                for rows in blocks:
+                    references_block = references[rows.start:] if triangular else references
+                    block = self.score_all(hypotheses[rows.start:rows.stop], references_block, progress_bar=False,
+                                           deduplicate=False)
+                    yield rows, np.asarray(block, dtype=np.float64)
+                return
+
+            with ProcessPoolExecutor(max_workers=resolve_n_jobs(n_jobs), initializer=init_worker,
+                                     initargs=(self, hypotheses, references)) as executor:
+                futures = {}
+                for rows in blocks:
+                    ref_start = rows.start if triangular else 0
+                    futures[executor.submit(score_worker_block, rows.start, rows.stop, ref_start)] = rows
+
+                for future in as_completed(futures):
+                    yield futures[future], future.result()
 
-        total = n * (n - 1) // 2  # Exclude diagonal
-        iterator = tqdm([(i, j) for i in range(n) for j in range(i + 1, n)],
-                        total=total, disable=not progress_bar or total == 1)
+    def parallel_score_all(self, hypotheses: Sequence[str], references: Sequence[str],
+                           progress_bar=True, n_jobs: Optional[int] = None) -> np.ndarray:
+        # Shards the hypotheses into blocks of rows, each scored against all references by score_all in a worker
+        scores = np.empty((len(hypotheses), len(references)))
+        blocks = chunk_ranges(len(hypotheses), row_block_size(len(hypotheses), len(references), n_jobs))
 
-        for i, j in iterator:
-            score = self.score(hypotheses[i], hypotheses[j])
-            scores[i][j] = scores[j][i] = score
+        with tqdm(total=scores.size, disable=not progress_bar or scores.size <= 1) as pbar:
+            for rows, block in self.iter_row_blocks(hypotheses, references, blocks, n_jobs=n_jobs):
+                scores[rows.start:rows.stop] = block
+                pbar.update(block.size)
 
-        return scores.tolist()
+        return scores
 
     def __str__(self):
         return self.name
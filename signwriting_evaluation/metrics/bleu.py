@@ -1,29 +1,129 @@
-from sacrebleu.metrics import BLEU
+import math
+from collections import Counter
+from typing import NamedTuple, Optional, Sequence
 
+import sacrebleu
+from sacrebleu.metrics import BLEU
+from sacrebleu.metrics.helpers import extract_all_word_ngrams
+from sacrebleu.utils import my_log
 from signwriting.tokenizer import SignWritingTokenizer
+from tqdm import tqdm
+
+from signwriting_evaluation.metrics.base import SignWritingMetric, DEFAULT_CACHE_SIZE, validate_corpus_score_input
+from signwriting_evaluation.metrics.parsed import SignWritingInput, signwriting_text
+
+BLEU_METRIC = BLEU(effective_order=True)  # sentence_bleu repeats its smoothing (exp) of sentence scores
+TOKENIZER = SignWritingTokenizer()
+
+
+class NgramStatistics(NamedTuple):
+    ngrams: Counter  # count of each n-gram (as a tuple of tokens), of all orders
+    length: int  # number of tokens
+    totals: tuple[int, ...]  # number of n-grams of each order
+
+
+def tokenize_text(text: str) -> str:
+    return " ".join(TOKENIZER.text_to_tokens(text))
+
+
+def tokens_ngram_statistics(tokens: str) -> NgramStatistics:
+    # Pre-processed and counted like each segment in sacrebleu's BLEU
+    ngrams, length = extract_all_word_ngrams(BLEU_METRIC.tokenizer(tokens.rstrip()), 1, BLEU_METRIC.max_ngram_order)
+    totals = [0] * BLEU_METRIC.max_ngram_order
+    for ngram, count in ngrams.items():
+        totals[len(ngram) - 1] += count
+    return NgramStatistics(ngrams, length, tuple(totals))
+
+
+def sentence_bleu(hypothesis: NgramStatistics, reference: NgramStatistics) -> float:
+    # Same as sacrebleu's sentence_score against a single reference, from the n-gram statistics of both.
+    # The arithmetic of BLEU.compute_bleu (exp smoothing, effective order) is repeated operation for operation,
+    # without building a BLEUScore, whose formatting takes most of the time of each pair
+    correct = [0] * BLEU_METRIC.max_ngram_order
+    for ngram in hypothesis.ngrams.keys() & reference.ngrams.keys():
+        correct[len(ngram) - 1] += min(hypothesis.ngrams[ngram], reference.ngrams[ngram])
+    if not any(correct):
+        return 0.0
 
-from signwriting_evaluation.metrics.base import SignWritingMetric, validate_corpus_score_input
+    brevity_penalty = 1.0
+    if hypothesis.length < reference.length:
+        brevity_penalty = math.exp(1 - reference.length / hypothesis.length) if hypothesis.length > 0 else 0.0
+
+    log_precisions = []
+    smooth_mteval = 1.
+    for order_correct, order_total in zip(correct, hypothesis.totals):
+        if order_total == 0:
+            break
+        if order_correct == 0:
+            smooth_mteval *= 2
+            log_precisions.append(my_log(100. / (smooth_mteval * order_total)))
+        else:
+            log_precisions.append(my_log(100. * order_correct / order_total))
+    return brevity_penalty * math.exp(sum(log_precisions) / len(log_precisions)) / 100
 
 
 class SignWritingBLEU(SignWritingMetric):
     """Wrapper for sacrebleu's BLEU metric with added tokenization."""
 
-    bleu = BLEU(effective_order=True)
-    tokenizer = SignWritingTokenizer()
+    bleu = BLEU_METRIC
+    tokenizer = TOKENIZER
 
-    def __init__(self):
+    def __init__(self, cache_size: Optional[int] = DEFAULT_CACHE_SIZE):
         super().__init__(name="TokenizedBLEU")
+        self.tokenize_text = self.cached(tokenize_text, cache_size)
+        self.tokens_ngram_statistics = self.cached(tokens_ngram_statistics, cache_size)
 
-    def tokenize(self, text: str) -> str:
-        return " ".join(self.tokenizer.text_to_tokens(text))
+    def configuration(self) -> dict:
+        return {**super().configuration(), "sacrebleu": sacrebleu.__version__,
+                "tokenize": self.bleu.tokenizer_signature, "max_ngram_order": self.bleu.max_ngram_order,
+                "smooth_method": self.bleu.smooth_method, "smooth_value": self.bleu.smooth_value,
+                "effective_order": self.bleu.effective_order, "lowercase": self.bleu.lowercase}
 
-    def score(self, hypothesis: str, reference: str) -> float:
-        hypothesis = self.tokenize(hypothesis)
-        reference = self.tokenize(reference)
-        return self.bleu.sentence_score(hypothesis, [reference]).score / 100
+    def tokenize(self, text: SignWritingInput) -> str:
+        # Tokenized once per text, from the original text of parsed inputs, so that their scores are the same
+        return self.tokenize_text(signwriting_text(text))
 
-    def corpus_score(self, hypotheses: list[str], references: list[list[str]]) -> float:
-        validate_corpus_score_input(hypotheses, references)
+    def canonical_text(self, text: SignWritingInput) -> str:
+        # Scores only depend on the tokens, which exclude box positions
+        return self.tokenize(text)
+
+    def ngram_statistics(self, text: SignWritingInput) -> NgramStatistics:
+        # Counted once per distinct tokens
+        return self.tokens_ngram_statistics(self.tokenize(text))
+
+    def score(self, hypothesis: SignWritingInput, reference: SignWritingInput) -> float:
+        return sentence_bleu(self.ngram_statistics(hypothesis), self.ngram_statistics(reference))
+
+    def score_all(self, hypotheses: Sequence[SignWritingInput], references: Sequence[SignWritingInput],
+                  progress_bar=True, n_jobs: Optional[int] = 1, *, deduplicate=True) -> list[list[float]]:
+        # Each text is tokenized and counted once, instead of once per pair
+        scores = self.dispatch_score_all(hypotheses, references, progress_bar, n_jobs, deduplicate)
+        if scores is not None:
+            return scores.tolist()
+
+        with self.stage("tokenize"):
+            hyp_statistics = [self.ngram_statistics(hypothesis) for hypothesis in hypotheses]
+            ref_statistics = [self.ngram_statistics(reference) for reference in references]
+        disable_progress_bar = not progress_bar or len(hypotheses) * len(references) <= 1
+        with self.stage("sentence_bleu"):
+            return [[sentence_bleu(hyp, ref) for ref in ref_statistics]
+                    for hyp in tqdm(hyp_statistics, disable=disable_progress_bar)]
+
+    def tokenize_corpus(self, hypotheses: list[SignWritingInput],
+                        references: list[list[SignWritingInput]]) -> tuple[list[str], list[list[str]]]:
         hypotheses = [self.tokenize(h) for h in hypotheses]
         references = [[self.tokenize(r) for r in reference] for reference in references]
-        return self.bleu.corpus_score(hypotheses, references).score / 100
+        return hypotheses, references
+
+    def corpus_score(self, hypotheses: list[SignWritingInput], references: list[list[SignWritingInput]]) -> float:
+        validate_corpus_score_input(hypotheses, references)
+        return self.bleu.corpus_score(*self.tokenize_corpus(hypotheses, references)).score / 100
+
+    def corpus_statistics(self, hypotheses: list[SignWritingInput],
+                          references: list[list[SignWritingInput]]) -> list[list[int]]:
+        # sacrebleu's statistics of each segment, whose sums are the statistics of the corpus
+        return self.bleu._extract_corpus_statistics(  # pylint: disable=protected-access
+            *self.tokenize_corpus(hypotheses, references))
+
+    def corpus_score_from_statistics(self, statistics: list[int]) -> float:
+        return self.bleu._compute_score_from_stats(statistics).score / 100  # pylint: disable=protected-access
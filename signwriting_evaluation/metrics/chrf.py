@@ -1,19 +1,195 @@
+from collections import Counter
+from typing import Iterator, Optional, Sequence, Union
+
+import numpy as np
+import sacrebleu
+import scipy.sparse
 from sacrebleu.metrics import CHRF
+from sacrebleu.metrics.helpers import extract_all_char_ngrams
+from tqdm import tqdm
+
+from signwriting_evaluation.metrics.base import SignWritingMetric, DEFAULT_CACHE_SIZE, MAX_BLOCK_CELLS, \
+    chunk_ranges, resolve_n_jobs, validate_corpus_score_input
+from signwriting_evaluation.metrics.parsed import SignWritingInput, signwriting_text
+
+CHRF_METRIC = CHRF()  # chrF2 of character n-grams only, as computed by chrf_from_statistics
+assert CHRF_METRIC.word_order == 0 and not CHRF_METRIC.eps_smoothing and not CHRF_METRIC.lowercase
+
+
+def text_char_ngrams(text: str) -> tuple[Counter, ...]:
+    # Counts of the character n-grams of each order (1 to char_order), like each segment in sacrebleu's chrF
+    return tuple(extract_all_char_ngrams(text, CHRF_METRIC.char_order, CHRF_METRIC.whitespace))
+
+
+def chrf_from_statistics(hyp_counts: np.ndarray, ref_counts: np.ndarray, matches: np.ndarray) -> np.ndarray:
+    # sacrebleu's chrF (CHRF._compute_f_score with effective order averaging) of arrays of pairs, repeated
+    # operation for operation, from the number of hypothesis, reference and matching n-grams of each order:
+    # arrays broadcastable to (char_order, ...)
+    factor = CHRF_METRIC.beta ** 2
+    avg_prec, avg_rec = 0.0, 0.0
+    effective_order = 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for n in range(CHRF_METRIC.char_order):
+            # Orders without hypothesis or reference n-grams are skipped
+            valid = (hyp_counts[n] > 0) & (ref_counts[n] > 0)
+            avg_prec = avg_prec + np.where(valid, matches[n] / hyp_counts[n], 0.0)
+            avg_rec = avg_rec + np.where(valid, matches[n] / ref_counts[n], 0.0)
+            effective_order = effective_order + valid
+
+        avg_prec = np.where(effective_order == 0, 0.0, avg_prec / effective_order)
+        avg_rec = np.where(effective_order == 0, 0.0, avg_rec / effective_order)
+        score = (1 + factor) * avg_prec * avg_rec
+        score = score / ((factor * avg_prec) + avg_rec)
+    return np.where(avg_prec + avg_rec != 0, 100 * score, 0.0) / 100
+
+
+def occurrence_matrix(ids: list[np.ndarray], counts: list[np.ndarray], offsets: np.ndarray,
+                      num_columns: int) -> scipy.sparse.csr_matrix:
+    # Binary matrix of the n-gram occurrences of each row, from the ids and counts of its n-grams:
+    # the kth occurrence of an n-gram is in column offsets[id] + k
+    row_ids = np.concatenate(ids or [[]]).astype(np.int64)
+    row_counts = np.concatenate(counts or [[]]).astype(np.int64)
+    num_occurrences = int(row_counts.sum())
+    run_starts = np.repeat(np.cumsum(row_counts) - row_counts, row_counts)
+    columns = np.repeat(offsets[row_ids], row_counts) + np.arange(num_occurrences) - run_starts
+    indptr = np.concatenate([[0], np.cumsum([int(row.sum()) for row in counts], dtype=np.int64)])
+    return scipy.sparse.csr_matrix((np.ones(num_occurrences, dtype=np.int32), columns, indptr),
+                                   shape=(len(ids), num_columns))
+
+
+def char_ngram_matrices(profiles: Sequence[tuple[Counter, ...]],
+                        other_profiles: Sequence[tuple[Counter, ...]]) -> list[tuple[scipy.sparse.csr_matrix, ...]]:
+    # For each n-gram order, sparse binary matrices of the n-gram occurrences of both sets of profiles,
+    # with a column for each (n-gram, k) whose row has at least k + 1 occurrences of the n-gram.
+    # The number of matching n-grams of two rows, sum(min(count1, count2)), is then the dot product of their rows
+    matrices = []
+    for n in range(CHRF_METRIC.char_order):
+        counters = [profile[n] for profile in profiles] + [profile[n] for profile in other_profiles]
+        vocabulary = {ngram: i for i, ngram in enumerate(dict.fromkeys(ngram for c in counters for ngram in c))}
+        ids = [np.fromiter(map(vocabulary.__getitem__, counter), dtype=np.int64, count=len(counter))
+               for counter in counters]
+        counts = [np.fromiter(counter.values(), dtype=np.int64, count=len(counter)) for counter in counters]
+
+        # Columns of the (n-gram, k) pairs start at the offset of each n-gram, spaced by its highest count
+        max_counts = np.zeros(len(vocabulary), dtype=np.int64)
+        np.maximum.at(max_counts, np.concatenate(ids or [[]]).astype(np.int64), np.concatenate(counts or [[]]))
+        offsets = np.cumsum(max_counts) - max_counts
+        num_columns = int(max_counts.sum())
+
+        split = len(profiles)
+        matrices.append((occurrence_matrix(ids[:split], counts[:split], offsets, num_columns),
+                         occurrence_matrix(ids[split:], counts[split:], offsets, num_columns)))
+    return matrices
 
-from signwriting_evaluation.metrics.base import SignWritingMetric, validate_corpus_score_input
+
+def ngram_totals(profiles: Sequence[tuple[Counter, ...]]) -> np.ndarray:
+    # Number of n-grams of each order, as a (char_order, num_profiles) array
+    return np.array([[sum(counter.values()) for counter in profile] for profile in profiles],
+                    dtype=np.int64).reshape(len(profiles), CHRF_METRIC.char_order).T
+
+
+def chrf_block(matrices: list[tuple[scipy.sparse.csr_matrix, ...]], rows: range,
+               hyp_totals: np.ndarray, ref_totals: np.ndarray, ref_start=0) -> np.ndarray:
+    # Scores of the hypotheses rows against the references from ref_start, from their char_ngram_matrices and
+    # ngram_totals. Matches of all orders are kept for each chunk of rows, bounded in memory by MAX_BLOCK_CELLS
+    if ref_start > 0:
+        matrices = [(hyp_matrix, ref_matrix[ref_start:]) for hyp_matrix, ref_matrix in matrices]
+        ref_totals = ref_totals[:, ref_start:]
+    scores = np.empty((len(rows), ref_totals.shape[1]))
+    chunk_size = max(1, MAX_BLOCK_CELLS // CHRF_METRIC.char_order // max(ref_totals.shape[1], 1))
+    for chunk in chunk_ranges(len(rows), chunk_size):
+        hyp_rows = slice(rows.start + chunk.start, rows.start + chunk.stop)
+        matches = np.empty((CHRF_METRIC.char_order, len(chunk), ref_totals.shape[1]), dtype=np.int64)
+        for n, (hyp_matrix, ref_matrix) in enumerate(matrices):
+            matches[n] = (hyp_matrix[hyp_rows] @ ref_matrix.T).toarray()
+        # Hypothesis n-grams are not counted for orders where the reference has none (as in sacrebleu)
+        ref_counts = ref_totals[:, np.newaxis]
+        hyp_counts = np.where(ref_counts > 0, hyp_totals[:, hyp_rows, np.newaxis], 0)
+        scores[chunk.start:chunk.stop] = chrf_from_statistics(hyp_counts, ref_counts, matches)
+    return scores
 
 
 class SignWritingCHRF(SignWritingMetric):
     """Wrapper for sacrebleu's CHRF metric."""
 
-    chrf = CHRF()
+    chrf = CHRF_METRIC
 
-    def __init__(self):
+    def __init__(self, cache_size: Optional[int] = DEFAULT_CACHE_SIZE):
         super().__init__(name="CHRF")
+        self.text_char_ngrams = self.cached(text_char_ngrams, cache_size)
+
+    def configuration(self) -> dict:
+        return {**super().configuration(), "sacrebleu": sacrebleu.__version__, "char_order": self.chrf.char_order,
+                "word_order": self.chrf.word_order, "beta": self.chrf.beta, "whitespace": self.chrf.whitespace,
+                "lowercase": self.chrf.lowercase, "eps_smoothing": self.chrf.eps_smoothing}
+
+    def char_ngrams(self, text: SignWritingInput) -> tuple[Counter, ...]:
+        return self.text_char_ngrams(signwriting_text(text))
+
+    def score(self, hypothesis: SignWritingInput, reference: SignWritingInput) -> float:
+        return self.chrf.sentence_score(signwriting_text(hypothesis), [signwriting_text(reference)]).score / 100
+
+    def score_all(self, hypotheses: Sequence[SignWritingInput], references: Sequence[SignWritingInput],
+                  progress_bar=True, n_jobs: Optional[int] = 1,
+                  as_array=False, *, deduplicate=True) -> Union[list[list[float]], np.ndarray]:
+        # The n-grams of each text are extracted once, into sparse matrices of n-gram occurrences,
+        # so that the matching n-grams of all pairs are counted by one sparse product for each order
+        # pylint: disable=too-many-arguments
+        scores = self.dispatch_score_all(hypotheses, references, progress_bar, n_jobs, deduplicate)
+        if scores is not None:
+            return scores if as_array else scores.tolist()
 
-    def score(self, hypothesis: str, reference: str) -> float:
-        return self.chrf.sentence_score(hypothesis, [reference]).score / 100
+        matrices, hyp_totals, ref_totals = self.ngram_matrices(hypotheses, references)
+        scores = np.empty((len(hypotheses), len(references)))
+        # Matches of all orders are kept for each block
+        blocks = chunk_ranges(len(hypotheses),
+                              max(1, MAX_BLOCK_CELLS // CHRF_METRIC.char_order // max(len(references), 1)))
+        for rows in tqdm(blocks, disable=not progress_bar or len(blocks) <= 1):
+            with self.stage("f_scores"):
+                scores[rows.start:rows.stop] = chrf_block(matrices, rows, hyp_totals, ref_totals)
+        return scores if as_array else scores.tolist()
 
-    def corpus_score(self, hypotheses: list[str], references: list[list[str]]) -> float:
+    def ngram_matrices(self, hypotheses: Sequence[SignWritingInput], references: Sequence[SignWritingInput]
+                       ) -> tuple[list[tuple[scipy.sparse.csr_matrix, ...]], np.ndarray, np.ndarray]:
+        # The char_ngram_matrices of the hypotheses and references, with their ngram_totals
+        with self.stage("extract"):
+            hyp_profiles = [self.char_ngrams(hypothesis) for hypothesis in hypotheses]
+            ref_profiles = hyp_profiles if references is hypotheses else \
+                [self.char_ngrams(reference) for reference in references]
+        with self.stage("matrices"):
+            matrices = char_ngram_matrices(hyp_profiles, ref_profiles)
+            return matrices, ngram_totals(hyp_profiles), ngram_totals(ref_profiles)
+
+    def iter_row_blocks(self, hypotheses: Sequence[SignWritingInput], references: Sequence[SignWritingInput],
+                        blocks: list[range], triangular=False,
+                        n_jobs: Optional[int] = 1) -> Iterator[tuple[range, np.ndarray]]:
+        # In a single process, the matrices of all texts are built once, and every block of rows is scored from them
+        # (score_all of each block would build the matrices of all references again)
+        if resolve_n_jobs(n_jobs) > 1:
+            yield from super().iter_row_blocks(hypotheses, references, blocks, triangular, n_jobs)
+            return
+
+        matrices, hyp_totals, ref_totals = self.ngram_matrices(hypotheses, references)
+        for rows in blocks:
+            with self.stage("f_scores"):
+                block = chrf_block(matrices, rows, hyp_totals, ref_totals, rows.start if triangular else 0)
+            yield rows, block
+
+    def corpus_texts(self, hypotheses: list[SignWritingInput],
+                     references: list[list[SignWritingInput]]) -> tuple[list[str], list[list[str]]]:
+        hypotheses = [signwriting_text(h) for h in hypotheses]
+        references = [[signwriting_text(r) for r in reference] for reference in references]
+        return hypotheses, references
+
+    def corpus_score(self, hypotheses: list[SignWritingInput], references: list[list[SignWritingInput]]) -> float:
         validate_corpus_score_input(hypotheses, references)
-        return self.chrf.corpus_score(hypotheses, references).score / 100
+        return self.chrf.corpus_score(*self.corpus_texts(hypotheses, references)).score / 100
+
+    def corpus_statistics(self, hypotheses: list[SignWritingInput],
+                          references: list[list[SignWritingInput]]) -> list[list[int]]:
+        # sacrebleu's statistics of each segment, whose sums are the statistics of the corpus
+        return self.chrf._extract_corpus_statistics(  # pylint: disable=protected-access
+            *self.corpus_texts(hypotheses, references))
+
+    def corpus_score_from_statistics(self, statistics: list[int]) -> float:
+        return self.chrf._compute_score_from_stats(statistics).score / 100  # pylint: disable=protected-access
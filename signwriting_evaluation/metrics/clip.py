@@ -1,21 +1,56 @@
 import hashlib
 import tempfile
-from typing import Union
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Iterable, Iterator, Optional, Union
 
 import diskcache
+import numpy as np
 import torch
 from PIL import Image
+from signwriting.formats.fsw_to_sign import fsw_to_sign
+from signwriting.formats.swu import is_swu
+from signwriting.formats.swu_to_fsw import swu2fsw
 from signwriting.visualizer.visualize import signwriting_to_image
 from tqdm import tqdm
 
-from signwriting_evaluation.metrics.base import SignWritingMetric
+from signwriting_evaluation.metrics.base import SignWritingMetric, MAX_BLOCK_CELLS, array_top_k, cache_report, \
+    chunk_ranges, resolve_n_jobs
+from signwriting_evaluation.metrics.embedding_store import EmbeddingStore, dequantize, quantize
+from signwriting_evaluation.metrics.parsed import ParsedSignWriting
 
-CLIPInput = Union[str, Image.Image]
+CLIPInput = Union[str, ParsedSignWriting, Image.Image]
+
+# Number of keys looked up in each query to the disk cache (older SQLite versions allow up to 999 parameters)
+CACHE_LOOKUP_BATCH_SIZE = 500
+
+# Batches rendered ahead of the model by each rendering process, bounding the memory of the prefetched pixels
+PREFETCH_BATCHES_PER_JOB = 2
+
+# State of each rendering process, set once by init_render_worker
+RENDER_WORKER_STATE = {}
+
+
+def disk_cache_contains(cache: diskcache.Cache, keys: list[str]) -> set[str]:
+    # Keys stored in the cache, found with one indexed query per batch of keys, without loading all of its keys.
+    # String keys are stored as is (raw) by diskcache, so they can be compared directly in SQL
+    found = set()
+    for start in range(0, len(keys), CACHE_LOOKUP_BATCH_SIZE):
+        batch = keys[start:start + CACHE_LOOKUP_BATCH_SIZE]
+        select = (f"SELECT key FROM Cache WHERE raw = 1 AND key IN ({', '.join('?' * len(batch))})"
+                  " AND (expire_time IS NULL OR expire_time > ?)")
+        rows = cache._sql(select, (*batch, time.time())).fetchall()  # pylint: disable=protected-access
+        found.update(key for key, in rows)
+    return found
 
 
 def signwriting_to_clip_image(signwriting: CLIPInput, size=224) -> Image:
     new_img = Image.new('RGB', (size, size), (255, 255, 255))
 
+    if isinstance(signwriting, ParsedSignWriting):
+        signwriting = signwriting.text
+
     if isinstance(signwriting, str):
         try:
             img = signwriting_to_image(signwriting, trust_box=False)
@@ -43,26 +78,81 @@ def signwriting_to_clip_image(signwriting: CLIPInput, size=224) -> Image:
     return new_img
 
 
-class SignWritingCLIPScore(SignWritingMetric):
+def canonical_fsw(fsw: str) -> str:
+    # The symbols of the text in order, translated so that their top-left corner is at 500x500, without boxes.
+    # Texts of the same canonical FSW render the same image: the box is ignored (trust_box=False), and the image is
+    # cropped to the symbols and centered. Symbols are not sorted, as the fill of each symbol covers the symbols before
+    if is_swu(fsw):
+        fsw = swu2fsw(fsw)
+    symbols = fsw_to_sign(fsw)["symbols"]
+    if len(symbols) == 0:
+        return ""
+    positions = np.array([symbol["position"] for symbol in symbols])
+    positions = positions - positions.min(axis=0) + 500
+    return "".join(f"{symbol['symbol']}{x}x{y}" for symbol, (x, y) in zip(symbols, positions.tolist()))
+
+
+def preprocess_clip_images(processor, batch: list[CLIPInput]) -> torch.Tensor:
+    images = [signwriting_to_clip_image(item) for item in batch]
+    return processor(images=images, return_tensors="pt")["pixel_values"]
+
+
+def init_render_worker(processor):
+    RENDER_WORKER_STATE["processor"] = processor
+
+
+def render_worker_batch(batch: list[CLIPInput]) -> torch.Tensor:
+    return preprocess_clip_images(RENDER_WORKER_STATE["processor"], batch)
+
+
+def quantization_deviation(features: np.ndarray, dtype: str, k=10) -> dict[str, float]:
+    # Deviation of the scores between all pairs of (held-out) features, when both are stored in dtype,
+    # from their float32 scores, and the mean fraction of each row's top k matches that are kept
+    quantized = dequantize(*quantize(features, dtype)).astype(np.float32)
+    scores = features @ features.T
+    quantized_scores = quantized @ quantized.T
+    deviations = np.abs(quantized_scores - scores)
+
+    k = min(k, len(features))
+    top_k = np.argsort(-scores, axis=1, kind="stable")[:, :k]
+    quantized_top_k = np.argsort(-quantized_scores, axis=1, kind="stable")[:, :k]
+    overlaps = [len(np.intersect1d(row, quantized_row)) / k for row, quantized_row in zip(top_k, quantized_top_k)]
+    return {
+        "dtype": dtype,
+        "bytes_per_vector": quantize(features[:1], dtype)[0].nbytes + (4 if dtype == "int8" else 0),
+        "max_deviation": float(deviations.max()),
+        "mean_deviation": float(deviations.mean()),
+        "top_k_overlap": float(np.mean(overlaps)),
+    }
+
+
+class SignWritingCLIPScore(SignWritingMetric):  # pylint: disable=too-many-public-methods
     def __init__(self,
                  cache_directory=f"{tempfile.gettempdir()}/clip_cache",
                  model_id="openai/clip-vit-base-patch32",
-                 device=None):
+                 device=None,
+                 cache_format="diskcache",
+                 cache_dtype="float32"):
         super().__init__(name="CLIPScore")
+        self.canonical_fsw = self.cached(canonical_fsw)
 
         # Init CLIP model pylint: disable=import-outside-toplevel
         from transformers import AutoModel, AutoProcessor
+        self.model_id = model_id
         self.processor = AutoProcessor.from_pretrained(model_id)
         self.model = AutoModel.from_pretrained(model_id)
 
-        # Init cache
+        # Init cache, either a diskcache of a tensor per input, or ("mmap") an EmbeddingStore matrix,
+        # which loads the features of many inputs at once, stored as cache_dtype (float32, float16 or int8).
+        # An existing store keeps the dtype it was created with
         if cache_directory is None:
             self.cache = {}
-            self.cached_texts = set()
         else:
             print("Using cache directory:", cache_directory)
-            self.cache = diskcache.Cache(cache_directory, size_limit=2 ** 36)  # 68 GB
-            self.cached_texts = set(self.cache.iterkeys())
+            if cache_format == "mmap":
+                self.cache = EmbeddingStore(cache_directory, dtype=cache_dtype)
+            else:
+                self.cache = diskcache.Cache(cache_directory, size_limit=2 ** 36)  # 68 GB
 
         # Init device
         self.batch_size = 1
@@ -72,6 +162,14 @@ class SignWritingCLIPScore(SignWritingMetric):
         else:
             self.device(device)
 
+    def configuration(self) -> dict:
+        # Features stored in lower precision (in an EmbeddingStore) change the scores
+        features_dtype = self.cache.dtype.name if isinstance(self.cache, EmbeddingStore) else "float32"
+        return {**super().configuration(), "model_id": self.model_id, "features_dtype": features_dtype}
+
+    def canonical_text(self, text: CLIPInput) -> str:
+        return self.cache_name(text)
+
     def cuda(self):
         return self.device(torch.device("cuda"))
 
@@ -88,60 +186,172 @@ class SignWritingCLIPScore(SignWritingMetric):
             self.batch_size = 16
         return self
 
-    def get_clip_features_batch(self, batch: list[CLIPInput]):
-        images = [signwriting_to_clip_image(item) for item in batch]
+    def compute_clip_features(self, batch: list[CLIPInput], pixels: Optional[torch.Tensor] = None) -> torch.Tensor:
+        # L2-normalized features of a batch (on the CPU), whose images may already be preprocessed into pixels
+        if pixels is None:
+            with self.stage("render"):
+                pixels = preprocess_clip_images(self.processor, batch)
+        with self.stage("forward"):
+            pixels = pixels.to(self.model.device)
+            with torch.no_grad():
+                img_features = self.model.get_image_features(pixels)
+            img_features_normalized = img_features / img_features.norm(p=2, dim=-1, keepdim=True)
+        return img_features_normalized.cpu()
 
-        pixels = self.processor(images=images, return_tensors="pt")["pixel_values"].to(self.model.device)
-        with torch.no_grad():
-            img_features = self.model.get_image_features(pixels)
-        img_features_normalized = img_features / img_features.norm(p=2, dim=-1, keepdim=True)
-        for i, item in enumerate(batch):
-            cache_name = self.cache_name(item)
-            self.cache[cache_name] = img_features_normalized[i].cpu()
-            self.cached_texts.add(cache_name)
+    def get_clip_features_batch(self, batch: list[CLIPInput], pixels: Optional[torch.Tensor] = None):
+        # Computes and caches the features of a batch, see compute_clip_features
+        features = self.compute_clip_features(batch, pixels)
+        with self.stage("store"):
+            self.store_features([self.cache_name(item) for item in batch], features)
 
-    def cache_name(self, clip_input: CLIPInput):
+    def store_features(self, cache_names: list[str], features: torch.Tensor):
+        if isinstance(self.cache, EmbeddingStore):
+            self.cache.add(cache_names, features.numpy())
+        else:
+            for cache_name, feature in zip(cache_names, features):
+                self.cache[cache_name] = feature
+
+    def load_features(self, cache_names: list[str], progress_bar=True) -> torch.Tensor:
+        if isinstance(self.cache, EmbeddingStore):
+            return torch.from_numpy(np.asarray(self.cache.get(cache_names), dtype=np.float32))
+
+        cache_names = tqdm(cache_names, desc="Loading features cache",
+                           disable=not progress_bar or len(cache_names) <= self.batch_size)
+        return torch.stack([self.cache[cache_name].cpu() for cache_name in cache_names])
+
+    def cache_name(self, clip_input: CLIPInput) -> str:
+        # Inputs are keyed by what the model sees of them, so that inputs rendering the same image share features:
+        # texts by their canonical_fsw, and images by their pixels after centering on the model's canvas
         if isinstance(clip_input, Image.Image):
-            return hashlib.md5(clip_input.tobytes()).hexdigest()
-        return clip_input
+            return hashlib.md5(signwriting_to_clip_image(clip_input).tobytes()).hexdigest()
+        if isinstance(clip_input, ParsedSignWriting):
+            return self.canonical_fsw(clip_input.text)
+        return self.canonical_fsw(clip_input)
+
+    def cached_names(self, cache_names: list[str]) -> set[str]:
+        if isinstance(self.cache, diskcache.Cache):
+            return disk_cache_contains(self.cache, cache_names)
+        return {cache_name for cache_name in cache_names if cache_name in self.cache}
+
+    def instrumentation_report(self) -> dict:
+        # Also reports the features cache (on disk or in memory), from the inputs found and missing in it
+        report = super().instrumentation_report()
+        counters = report["counters"]
+        report["caches"]["features"] = cache_report(counters.get("features_cache_hits", 0),
+                                                    counters.get("features_cache_misses", 0),
+                                                    currsize=len(self.cache))
+        return report
+
+    def iter_preprocessed_batches(self, batches: Iterable[list[CLIPInput]], n_jobs: Optional[int] = 1
+                                  ) -> Iterator[tuple[list[CLIPInput], Optional[torch.Tensor]]]:
+        # Yields (batch, pixels) in order. With multiple jobs, rendering processes preprocess the upcoming batches
+        # while the model runs on the current one, at most PREFETCH_BATCHES_PER_JOB batches ahead per process.
+        # With a single job, batches are preprocessed by get_clip_features_batch (pixels are None)
+        n_jobs = resolve_n_jobs(n_jobs)
+        if n_jobs == 1:
+            for batch in batches:
+                yield batch, None
+            return
+
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=init_render_worker,
+                                 initargs=(self.processor,)) as executor:
+            pending = deque()
+            for batch in batches:
+                pending.append((batch, executor.submit(render_worker_batch, batch)))
+                if len(pending) >= n_jobs * PREFETCH_BATCHES_PER_JOB:
+                    yield self.rendered_batch(*pending.popleft())
+            while len(pending) > 0:
+                yield self.rendered_batch(*pending.popleft())
+
+    def rendered_batch(self, batch: list[CLIPInput], future: Future) -> tuple[list[CLIPInput], torch.Tensor]:
+        # The time spent waiting for rendering processes
+        with self.stage("render_wait"):
+            return batch, future.result()
 
-    def get_clip_features(self, inputs: list[CLIPInput], progress_bar=True):
-        missing = [clip_input for clip_input in inputs if self.cache_name(clip_input) not in self.cached_texts]
+    def get_clip_features(self, inputs: list[CLIPInput], progress_bar=True, n_jobs: Optional[int] = 1):
+        # Inputs are computed once each, if missing from the cache
+        inputs_by_name = {self.cache_name(clip_input): clip_input for clip_input in inputs}
+        with self.stage("cache_lookup"):
+            cached = self.cached_names(list(inputs_by_name.keys()))
+        missing = [clip_input for name, clip_input in inputs_by_name.items() if name not in cached]
+        self.count("features_cache_hits", len(inputs_by_name) - len(missing))
+        self.count("features_cache_misses", len(missing))
 
         if len(missing) > 0:
             pbar_disable = not progress_bar or len(missing) <= self.batch_size
-            pbar = tqdm(total=len(inputs), initial=len(inputs) - len(missing),
+            pbar = tqdm(total=len(inputs_by_name), initial=len(inputs_by_name) - len(missing),
                         desc="Computing CLIP features", disable=pbar_disable)
 
-            # pylint: disable=fixme
-            # TODO: we could parallelize this if it's too slow for practical use
             batches = (missing[i:i + self.batch_size] for i in range(0, len(missing), self.batch_size))
-            for batch in batches:
-                self.get_clip_features_batch(batch)
+            for batch, pixels in self.iter_preprocessed_batches(batches, n_jobs):
+                self.get_clip_features_batch(batch, pixels)
                 pbar.update(len(batch))
 
             pbar.close()
 
-        texts = tqdm(inputs, desc="Loading features cache",
-                     disable=not progress_bar or len(inputs) <= self.batch_size)
-        cached_features = [self.cache[self.cache_name(text)].cpu() for text in texts]
-        features = torch.stack(cached_features)
-
-        return features.to(self.model.device)
+        with self.stage("load"):
+            features = self.load_features([self.cache_name(clip_input) for clip_input in inputs], progress_bar)
+            return features.to(self.model.device)
 
     def score(self, hypothesis: CLIPInput, reference: CLIPInput) -> float:
-        return self.score_all([hypothesis], [reference])[0][0]
+        return self.score_all([hypothesis], [reference], deduplicate=False)[0][0]
+
+    def iter_score_blocks(self, hypotheses: list[CLIPInput], references: list[CLIPInput],
+                          progress_bar=True, n_jobs: Optional[int] = 1) -> Iterator[tuple[range, np.ndarray]]:
+        # Yields the scores in blocks of rows, as (rows, scores). Features are L2-normalized,
+        # so the cosine similarities of a block are one matrix product, bounded in memory by MAX_BLOCK_CELLS
+        hyp_features = self.get_clip_features(hypotheses, progress_bar, n_jobs)
+        ref_features = self.get_clip_features(references, progress_bar, n_jobs)
+        blocks = chunk_ranges(len(hypotheses), max(1, MAX_BLOCK_CELLS // max(len(references), 1)))
+        for rows in tqdm(blocks, desc="Computing CLIP scores", disable=not progress_bar or len(blocks) <= 1):
+            with self.stage("similarity"):
+                block = (hyp_features[rows.start:rows.stop] @ ref_features.T).cpu().numpy()
+            yield rows, block
+
+    def iter_row_blocks(self, hypotheses: list[CLIPInput], references: list[CLIPInput], blocks: list[range],
+                        triangular=False, n_jobs: Optional[int] = 1) -> Iterator[tuple[range, np.ndarray]]:
+        # Blocks are scored in this process, from features computed once (n_jobs processes render the images,
+        # as in score_all). Scoring processes would each receive the model and the features cache, and compute
+        # and store the missing features again
+        hyp_features = self.get_clip_features(hypotheses, progress_bar=False, n_jobs=n_jobs)
+        ref_features = hyp_features if references is hypotheses else \
+            self.get_clip_features(references, progress_bar=False, n_jobs=n_jobs)
+        for rows in blocks:
+            ref_start = rows.start if triangular else 0
+            with self.stage("similarity"):
+                block = (hyp_features[rows.start:rows.stop] @ ref_features[ref_start:].T).cpu().numpy()
+            yield rows, block.astype(np.float64)
 
     def score_all(self, hypotheses: list[CLIPInput], references: list[CLIPInput],
-                  progress_bar=True) -> list[list[float]]:
-        hyp_features = self.get_clip_features(hypotheses, progress_bar)
-        ref_features = self.get_clip_features(references, progress_bar)
-
-        similarities = []
-        for hyp_feature in hyp_features:
-            hyp_batched = hyp_feature.unsqueeze(0)
-            # pylint: disable=not-callable
-            similarity = torch.nn.functional.cosine_similarity(hyp_batched, ref_features)
-            similarities.append(similarity.tolist())
-
-        return similarities
+                  progress_bar=True, n_jobs: Optional[int] = 1, as_array=False,
+                  *, deduplicate=True) -> Union[list[list[float]], np.ndarray]:
+        # n_jobs processes render the images, while the model computes the features in this process
+        # pylint: disable=too-many-arguments
+        if deduplicate:
+            scores = self.deduplicated_score_all(hypotheses, references, progress_bar, n_jobs)
+            return scores if as_array else scores.tolist()
+
+        scores = np.empty((len(hypotheses), len(references)), dtype=np.float32)
+        for rows, block in self.iter_score_blocks(hypotheses, references, progress_bar, n_jobs):
+            scores[rows.start:rows.stop] = block
+        return scores if as_array else scores.tolist()
+
+    def top_k(self, queries: list[CLIPInput], corpus: list[CLIPInput], k=10,
+              progress_bar=True) -> tuple[list[list[int]], list[list[float]]]:
+        all_indices, all_scores = [], []
+        for _, block in self.iter_score_blocks(queries, corpus, progress_bar):
+            for scores in block:
+                indices, scores = array_top_k(scores, k)
+                all_indices.append(indices)
+                all_scores.append(scores)
+        return all_indices, all_scores
+
+    def quantization_report(self, held_out: list[CLIPInput], dtypes=("float16", "int8"), k=10,
+                            progress_bar=True) -> list[dict[str, float]]:
+        # Score deviations of each cache dtype from float32 features, see quantization_deviation.
+        # Features are computed without the features cache, which may store them in lower precision already
+        batches = [held_out[i:i + self.batch_size] for i in range(0, len(held_out), self.batch_size)]
+        features = [self.compute_clip_features(batch)
+                    for batch in tqdm(batches, desc="Computing CLIP features", disable=not progress_bar)]
+        features = torch.cat(features).float().numpy()
+        return [quantization_deviation(features, dtype, k) for dtype in dtypes]
@@ -0,0 +1,166 @@
+import json
+import os
+from pathlib import Path
+from typing import Iterable, Optional, Union
+
+import numpy as np
+
+EMBEDDING_DTYPES = ("float32", "float16", "int8")
+
+
+def quantize(embeddings: np.ndarray, dtype="float32") -> tuple[np.ndarray, Optional[np.ndarray]]:
+    # Embeddings in a storage dtype, returned with their per-vector scales for int8 (None otherwise).
+    # int8 vectors are scaled so their largest absolute value is 127
+    assert dtype in EMBEDDING_DTYPES, f"Unknown embedding dtype {dtype}, expected one of {EMBEDDING_DTYPES}"
+    if dtype != "int8":
+        return embeddings.astype(dtype), None
+    scales = np.abs(embeddings).max(axis=-1).astype(np.float32) / 127
+    scales[scales == 0] = 1
+    values = np.rint(embeddings / scales[:, np.newaxis]).clip(-127, 127).astype(np.int8)
+    return values, scales
+
+
+def dequantize(values: np.ndarray, scales: Optional[np.ndarray] = None) -> np.ndarray:
+    if scales is None:
+        return values
+    return values.astype(np.float32) * scales[:, np.newaxis]
+
+
+class EmbeddingStore:  # pylint: disable=too-many-instance-attributes
+    """Embeddings stored as the rows of one contiguous memory-mapped matrix, with an index of keys to rows.
+    New embeddings are appended to the end of the files, in batches. Files are written by a single process (see add).
+    - {name}.bin: the raw matrix (num_keys, dim), in row order, of float32, float16 or int8 values
+    - {name}.scales: for int8 values, the float32 scale of each row
+    - {name}.keys: one key per line, where line i is the key of row i
+    - {name}.json: the dimension and dtype of the matrix"""
+
+    def __init__(self, directory: Union[str, Path], name="embeddings", dtype="float32"):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.name = name
+
+        self.dim: Optional[int] = None  # known once the first embeddings are added
+        self.dtype = np.dtype(dtype)
+        if self.path("json").exists():
+            with open(self.path("json"), 'r', encoding='utf-8') as meta_f:
+                meta = json.load(meta_f)
+            self.dim, self.dtype = meta["dim"], np.dtype(meta["dtype"])
+        assert self.dtype.name in EMBEDDING_DTYPES, f"Unknown embedding dtype {self.dtype}"
+
+        self.index: dict[str, int] = {}
+        if self.path("keys").exists():
+            with open(self.path("keys"), 'r', encoding='utf-8', newline="") as keys_f:
+                keys = keys_f.read().split("\n")[:-1]
+            self.index = {key: row for row, key in enumerate(keys)}
+            if len(self.index) < len(keys):
+                raise ValueError(f"{self.path('keys')} has duplicate keys, the store is corrupted")
+            self.check_rows("bin", (self.dim or 0) * self.dtype.itemsize)
+            if self.dtype == np.int8:
+                self.check_rows("scales", np.dtype(np.float32).itemsize)
+        # Memory-mapped lazily, and again after every append
+        self._matrix: Optional[np.ndarray] = None
+        self._scales: Optional[np.ndarray] = None
+
+        self.pid = os.getpid()  # of the process that opened the store, the only one writing to it
+        self.keys_size = self.file_size("keys")  # when last read or written by this store
+
+    def file_size(self, suffix: str) -> int:
+        path = self.path(suffix)
+        return path.stat().st_size if path.exists() else 0
+
+    def check_rows(self, suffix: str, row_size: int):
+        # Every key has its row (a file may have rows without keys, when writing their keys failed)
+        num_rows = self.file_size(suffix) // row_size if row_size > 0 else 0
+        if num_rows < len(self):
+            raise ValueError(f"{self.path(suffix)} has {num_rows} rows for {len(self)} keys, the store is corrupted")
+
+    def path(self, suffix: str) -> Path:
+        return self.directory / f"{self.name}.{suffix}"
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key: str):
+        return key in self.index
+
+    @property
+    def matrix(self) -> np.ndarray:
+        # All stored values, mapped from the file (copy-on-write: changes to the array are not saved)
+        if self._matrix is None:
+            if len(self) == 0:
+                return np.empty((0, self.dim or 0), dtype=self.dtype)
+            self._matrix = np.memmap(self.path("bin"), dtype=self.dtype, mode="c", shape=(len(self), self.dim))
+        return self._matrix
+
+    @property
+    def scales(self) -> Optional[np.ndarray]:
+        # Scales of all stored int8 rows (None for float dtypes)
+        if self.dtype != np.int8:
+            return None
+        if self._scales is None:
+            if len(self) == 0:
+                return np.empty(0, dtype=np.float32)
+            self._scales = np.memmap(self.path("scales"), dtype=np.float32, mode="c", shape=(len(self),))
+        return self._scales
+
+    def rows(self, keys: Iterable[str]) -> np.ndarray:
+        return np.fromiter((self.index[key] for key in keys), dtype=np.int64)
+
+    def get_quantized(self, keys: Iterable[str]) -> tuple[np.ndarray, Optional[np.ndarray]]:
+        # Stored values and scales of the keys, in order. Consecutive rows (such as a whole lexicon) are views
+        rows = self.rows(keys)
+        scales = self.scales
+        if len(rows) > 0 and rows.max() >= len(self.matrix):
+            raise IndexError(f"Row {rows.max()} is out of the {len(self.matrix)} rows of {self.path('bin')}")
+        if len(rows) > 0 and np.all(np.diff(rows) == 1):
+            rows = slice(rows[0], rows[-1] + 1)
+        return self.matrix[rows], None if scales is None else scales[rows]
+
+    def get(self, keys: Iterable[str]) -> np.ndarray:
+        # Embeddings of the keys, in order (int8 values are scaled back to float32)
+        return dequantize(*self.get_quantized(keys))
+
+    def add(self, keys: list[str], embeddings: np.ndarray):
+        # Appends the embeddings of new keys (keys already stored are skipped).
+        # Rows are written after the rows known to this store, so only the process that opened it writes to it:
+        # a copy in another process (e.g. pickled to a worker), or another store of the same files which appended
+        # to them, would write rows at the same offsets and duplicate keys
+        new_rows = {}
+        for key, embedding in zip(keys, embeddings):
+            assert "\n" not in key, "Keys must be on a single line"
+            if key not in self.index and key not in new_rows:
+                new_rows[key] = embedding
+        if len(new_rows) == 0:
+            return
+
+        if os.getpid() != self.pid:
+            raise RuntimeError(f"{self.directory} is written by the process that opened it ({self.pid})")
+        if self.file_size("keys") != self.keys_size:
+            raise RuntimeError(f"{self.path('keys')} was written by another store, open the store again")
+
+        if self.dim is None:
+            self.dim = embeddings.shape[1]
+            with open(self.path("json"), 'w', encoding='utf-8') as meta_f:
+                json.dump({"dim": self.dim, "dtype": self.dtype.name}, meta_f)
+        assert embeddings.shape[1] == self.dim, f"Expected embeddings of dimension {self.dim}"
+
+        # Rows are written before their keys, so a key is never indexed without its embedding
+        values, scales = quantize(np.stack(list(new_rows.values())), self.dtype.name)
+        self.write_rows("bin", values)
+        if scales is not None:
+            self.write_rows("scales", scales)
+        with open(self.path("keys"), 'a', encoding='utf-8', newline="") as keys_f:
+            keys_f.write("".join(f"{key}\n" for key in new_rows))
+        self.keys_size = self.file_size("keys")
+
+        for key in new_rows:
+            self.index[key] = len(self.index)
+        self._matrix = self._scales = None
+
+    def write_rows(self, suffix: str, rows: np.ndarray):
+        # Writes rows after the last indexed row of a file (overwriting rows without keys, if any)
+        rows = np.ascontiguousarray(rows)
+        path = self.path(suffix)
+        with open(path, 'r+b' if path.exists() else 'wb') as rows_f:
+            rows_f.seek(len(self) * rows[0].nbytes)
+            rows_f.write(rows.tobytes())
@@ -0,0 +1,58 @@
+from typing import Sequence
+
+import numpy as np
+from tqdm import tqdm
+
+from signwriting_evaluation.metrics.base import SignWritingMetric, validate_corpus_score_input
+from signwriting_evaluation.metrics.parsed import ParsedSignWriting, SignWritingInput, parse_signwriting, \
+    signwriting_text
+
+
+class MultiMetricEvaluator:
+    """Scores the same hypotheses and references with several metrics.
+    Each distinct text is normalized and parsed once, and the parsed texts are shared by all metrics.
+    Score grids are computed for distinct texts only, by one score_all call of each metric."""
+
+    def __init__(self, metrics: Sequence[SignWritingMetric]):
+        names = [metric.name for metric in metrics]
+        assert len(set(names)) == len(names), f"Metrics must have distinct names, found {names}"
+        self.metrics = list(metrics)
+
+    def parse(self, texts: Sequence[SignWritingInput]) -> dict[str, ParsedSignWriting]:
+        # The parsed text of each distinct text, in order of first appearance
+        parsed = {}
+        for text in texts:
+            key = signwriting_text(text)
+            if key not in parsed:
+                parsed[key] = text if isinstance(text, ParsedSignWriting) else parse_signwriting(text)
+        return parsed
+
+    def score_all(self, hypotheses: Sequence[SignWritingInput], references: Sequence[SignWritingInput],
+                  progress_bar=True) -> dict[str, np.ndarray]:
+        # The (hypotheses, references) score grid of each metric, by metric name
+        hyp_parsed = self.parse(hypotheses)
+        ref_parsed = self.parse(references)
+
+        # Rows and columns of each text in the grids of distinct texts
+        hyp_index = {text: i for i, text in enumerate(hyp_parsed)}
+        ref_index = {text: j for j, text in enumerate(ref_parsed)}
+        rows = np.array([hyp_index[signwriting_text(h)] for h in hypotheses], dtype=np.int64)
+        columns = np.array([ref_index[signwriting_text(r)] for r in references], dtype=np.int64)
+
+        results = {}
+        with tqdm(self.metrics, disable=not progress_bar or len(self.metrics) <= 1) as metrics:
+            for metric in metrics:
+                metrics.set_postfix_str(metric.name)
+                scores = metric.score_all(list(hyp_parsed.values()), list(ref_parsed.values()), progress_bar=False)
+                scores = np.asarray(scores, dtype=np.float64).reshape(len(hyp_parsed), len(ref_parsed))
+                results[metric.name] = scores[np.ix_(rows, columns)]
+        return results
+
+    def corpus_score(self, hypotheses: Sequence[SignWritingInput],
+                     references: Sequence[list[SignWritingInput]]) -> dict[str, float]:
+        # The corpus score of each metric, by metric name
+        validate_corpus_score_input(hypotheses, references)
+        parsed = self.parse([*hypotheses, *(r for reference in references for r in reference)])
+        hypotheses = [parsed[signwriting_text(h)] for h in hypotheses]
+        references = [[parsed[signwriting_text(r)] for r in reference] for reference in references]
+        return {metric.name: metric.corpus_score(hypotheses, references) for metric in self.metrics}
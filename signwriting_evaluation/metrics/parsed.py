@@ -0,0 +1,62 @@
+from dataclasses import dataclass
+from typing import Union
+
+import numpy as np
+from signwriting.formats.fsw_to_sign import fsw_to_sign
+from signwriting.formats.swu_to_fsw import swu2fsw
+from signwriting.tokenizer import normalize_signwriting
+
+
+@dataclass(eq=False, slots=True)  # compared and hashed by identity
+class ParsedSignWriting:
+    """SignWriting text parsed once into small integer arrays, to be shared by all metrics.
+    The symbols of all signs are stored together, where the symbols of sign i are
+    symbols[sign_offsets[i]:sign_offsets[i + 1]]. Symbol ids are the FSW symbol key as a number (S10000 = 0x10000)."""
+
+    text: str  # the original text, for metrics that work on strings
+    boxes: str  # box symbol (B, L, M or R) of each sign
+    box_positions: np.ndarray  # (num_signs, 2)
+    symbols: np.ndarray  # (num_symbols,)
+    positions: np.ndarray  # (num_symbols, 2)
+    sign_offsets: np.ndarray  # (num_signs + 1,)
+
+    @property
+    def num_signs(self) -> int:
+        return len(self.boxes)
+
+    def sign_symbols(self, i: int) -> tuple[np.ndarray, np.ndarray]:
+        # Symbol ids and positions of sign i
+        start, end = self.sign_offsets[i], self.sign_offsets[i + 1]
+        return self.symbols[start:end], self.positions[start:end]
+
+    def __str__(self):
+        return self.text
+
+
+SignWritingInput = Union[str, ParsedSignWriting]
+
+
+def normalized_signs(text: str) -> list[str]:
+    # The normalized FSW of each sign of a text
+    text_as_fsw = swu2fsw(text)  # converts swu symbols to fsw, while keeping the fsw symbols if present
+    return normalize_signwriting(text_as_fsw).split(" ")
+
+
+def parse_signwriting(text: str) -> ParsedSignWriting:
+    signs = [fsw_to_sign(sign_fsw) for sign_fsw in normalized_signs(text)]
+    symbols = [symbol for sign in signs for symbol in sign["symbols"]]
+    return ParsedSignWriting(
+        text=text,
+        boxes="".join(sign["box"]["symbol"] for sign in signs),
+        box_positions=np.array([sign["box"]["position"] for sign in signs], dtype=np.int16).reshape(-1, 2),
+        symbols=np.array([int(symbol["symbol"][1:6], 16) for symbol in symbols], dtype=np.uint32),
+        positions=np.array([symbol["position"] for symbol in symbols], dtype=np.int16).reshape(-1, 2),
+        sign_offsets=np.cumsum([0] + [len(sign["symbols"]) for sign in signs], dtype=np.int32),
+    )
+
+
+def signwriting_text(signwriting: SignWritingInput) -> str:
+    # The text of a parsed input, for metrics that work on strings
+    if isinstance(signwriting, ParsedSignWriting):
+        return signwriting.text
+    return signwriting
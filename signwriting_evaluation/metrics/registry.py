@@ -0,0 +1,24 @@
+import importlib
+
+from signwriting_evaluation.metrics.base import SignWritingMetric
+
+# Module and class of each metric. A module is only imported when its metric is requested,
+# so that using the light metrics does not import the heavy dependencies of others (torch and transformers for CLIP)
+METRICS = {
+    "bleu": ("signwriting_evaluation.metrics.bleu", "SignWritingBLEU"),
+    "chrf": ("signwriting_evaluation.metrics.chrf", "SignWritingCHRF"),
+    "clip": ("signwriting_evaluation.metrics.clip", "SignWritingCLIPScore"),
+    "similarity": ("signwriting_evaluation.metrics.similarity", "SignWritingSimilarityMetric"),
+}
+
+
+def get_metric_class(name: str) -> type[SignWritingMetric]:
+    if name not in METRICS:
+        raise ValueError(f"Unknown metric {name!r}, expected one of {list(METRICS)}")
+    module_name, class_name = METRICS[name]
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def get_metric(name: str, **kwargs) -> SignWritingMetric:
+    # Constructs a metric by name, for example get_metric("similarity") or get_metric("clip", device="cpu")
+    return get_metric_class(name)(**kwargs)
@@ -0,0 +1,193 @@
+import itertools
+import json
+import sqlite3
+from pathlib import Path
+from typing import Iterable, Optional, Sequence, Union
+
+import numpy as np
+
+from signwriting_evaluation.metrics.base import SignWritingMetric, cache_report
+from signwriting_evaluation.metrics.parsed import SignWritingInput
+
+# Seconds to wait for the lock of a database written by another process (e.g. the workers of score_self)
+LOCK_TIMEOUT = 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS configurations (
+    id INTEGER PRIMARY KEY,
+    hash TEXT NOT NULL UNIQUE,
+    configuration TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS scores (
+    configuration_id INTEGER NOT NULL REFERENCES configurations (id),
+    hypothesis TEXT NOT NULL,
+    reference TEXT NOT NULL,
+    score REAL NOT NULL,
+    PRIMARY KEY (configuration_id, hypothesis, reference)
+) WITHOUT ROWID;
+"""
+
+PairKey = tuple[str, str]
+
+
+class PairScoreCache:
+    """Scores of (hypothesis, reference) pairs, persisted in an SQLite database across runs.
+    Scores are stored per metric configuration (see SignWritingMetric.configuration_hash), so scores of another
+    configuration or version of a metric are never reused. Pairs are looked up in batches, by one query each.
+    It is pickled without its connection, and each process opens its own."""
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection: Optional[sqlite3.Connection] = None
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, timeout=LOCK_TIMEOUT)
+            self._connection.execute("PRAGMA journal_mode=WAL")  # readers are not blocked by a writer
+            self._connection.executescript(SCHEMA)
+            self._connection.execute("CREATE TEMP TABLE IF NOT EXISTS lookup (hypothesis TEXT, reference TEXT)")
+        return self._connection
+
+    def configuration_id(self, configuration_hash: str, configuration: dict) -> int:
+        # The id of a configuration, stored with its settings to inspect the database
+        with self.connection:
+            self.connection.execute("INSERT OR IGNORE INTO configurations (hash, configuration) VALUES (?, ?)",
+                                    (configuration_hash, json.dumps(configuration, sort_keys=True, default=str)))
+        select = "SELECT id FROM configurations WHERE hash = ?"
+        return self.connection.execute(select, (configuration_hash,)).fetchone()[0]
+
+    def get(self, configuration_id: int, keys: Iterable[PairKey]) -> dict[PairKey, float]:
+        # Scores of the stored pairs among the keys, joined with a temporary table of the keys in one query
+        with self.connection:
+            self.connection.execute("DELETE FROM lookup")
+            self.connection.executemany("INSERT INTO lookup VALUES (?, ?)", keys)
+            rows = self.connection.execute("SELECT scores.hypothesis, scores.reference, scores.score FROM lookup "
+                                           "JOIN scores ON scores.configuration_id = ? "
+                                           "AND scores.hypothesis = lookup.hypothesis "
+                                           "AND scores.reference = lookup.reference", (configuration_id,))
+            return {(hypothesis, reference): score for hypothesis, reference, score in rows}
+
+    def put(self, configuration_id: int, scores: dict[PairKey, float]):
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?)",
+                                        ((configuration_id, hypothesis, reference, float(score))
+                                         for (hypothesis, reference), score in scores.items()))
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM scores").fetchone()[0]
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def __getstate__(self):
+        return {"path": self.path, "_connection": None}
+
+
+class CachedScoresMetric(SignWritingMetric):
+    """A metric whose pair scores are persisted in a PairScoreCache, and only computed for pairs missing from it.
+    Pairs are keyed by the canonical texts of the metric (and in sorted order for symmetric metrics).
+    For example: CachedScoresMetric(SignWritingSimilarityMetric(), "scores.sqlite")"""
+
+    def __init__(self, metric: SignWritingMetric, cache: Union[str, Path, PairScoreCache]):
+        super().__init__(name=metric.name)
+        self.metric = metric
+        self.SYMMETRIC = metric.SYMMETRIC  # pylint: disable=invalid-name
+        self.score_cache = cache if isinstance(cache, PairScoreCache) else PairScoreCache(cache)
+        self.configuration_id = self.score_cache.configuration_id(metric.configuration_hash(),
+                                                                  metric.configuration())
+
+    def configuration(self) -> dict:
+        return self.metric.configuration()
+
+    def canonical_text(self, text: SignWritingInput) -> str:
+        return self.metric.canonical_text(text)
+
+    def cache_info(self) -> dict[str, tuple]:
+        return self.metric.cache_info()
+
+    def clear_caches(self):
+        self.metric.clear_caches()
+
+    def fitted_caches(self, size: int):
+        return self.metric.fitted_caches(size)
+
+    def instrumentation_report(self) -> dict:
+        # The report of the metric, with the persisted scores found and missing in the cache
+        report = self.metric.instrumentation_report()
+        counters = self.instrumentation.counters if self.instrumentation is not None else {}
+        report["caches"]["scores"] = cache_report(counters.get("score_cache_hits", 0),
+                                                  counters.get("score_cache_misses", 0))
+        return report
+
+    def lookup(self, keys: set[PairKey]) -> dict[PairKey, float]:
+        with self.stage("score_cache_lookup"):
+            known = self.score_cache.get(self.configuration_id, keys)
+        self.count("score_cache_hits", len(known))
+        self.count("score_cache_misses", len(keys) - len(known))
+        return known
+
+    def lookup_grid(self, keys: list[list[PairKey]]) -> np.ndarray:
+        # Scores of rows of keys, NaN for the pairs missing from the cache
+        known = self.lookup({key for row in keys for key in row})
+        return np.array([[known.get(key, np.nan) for key in row] for row in keys], dtype=np.float64)
+
+    def score(self, hypothesis: SignWritingInput, reference: SignWritingInput) -> float:
+        return self.pair_scores([(hypothesis, reference)])[0]
+
+    def pair_scores(self, pairs: Sequence[tuple[SignWritingInput, SignWritingInput]]) -> list[float]:
+        # Scores of a list of pairs, where the distinct pairs missing from the cache are scored by the metric
+        keys = [self.pair_key(self.canonical_text(h), self.canonical_text(r)) for h, r in pairs]
+        known = self.lookup(set(keys))
+        missing = {}
+        for key, pair in zip(keys, pairs):
+            if key not in known:
+                missing.setdefault(key, pair)
+        computed = dict(zip(missing, self.metric.pair_scores(list(missing.values()))))
+        self.score_cache.put(self.configuration_id, computed)
+        known.update(computed)
+        return [known[key] for key in keys]
+
+    def score_all(self, hypotheses: Sequence[SignWritingInput], references: Sequence[SignWritingInput],
+                  progress_bar=True, n_jobs: Optional[int] = 1, *,
+                  deduplicate=True) -> list[list[float]]:  # pylint: disable=unused-argument
+        # Scores of distinct texts are looked up at once (whether deduplicate is set or not), and the metric scores
+        # the rows and columns with missing pairs (by its own score_all), from which the missing pairs are stored
+        hyps, hyp_rows = self.distinct_inputs(hypotheses)
+        refs, ref_columns = self.distinct_inputs(references)
+
+        keys = [[self.pair_key(h, r) for r in refs] for h in hyps]
+        scores = self.lookup_grid(keys).reshape(len(hyps), len(refs))
+
+        missing = np.isnan(scores)
+        rows, columns = missing.any(axis=1), missing.any(axis=0)
+        if rows.any():
+            scores[np.ix_(rows, columns)] = self.metric.score_grid(list(itertools.compress(hyps.values(), rows)),
+                                                                   list(itertools.compress(refs.values(), columns)),
+                                                                   progress_bar, n_jobs)
+            self.score_cache.put(self.configuration_id, {keys[i][j]: scores[i, j] for i, j in zip(*missing.nonzero())})
+
+        return scores[np.ix_(hyp_rows, ref_columns)].tolist()
+
+    def averages_sentence_scores(self) -> bool:
+        # Whether the corpus score of the metric is the default average of sentence scores,
+        # rather than of corpus-level statistics (as BLEU and chrF), which have no pair scores to persist
+        return type(self.metric).corpus_statistics is SignWritingMetric.corpus_statistics
+
+    def corpus_score(self, hypotheses: Sequence[SignWritingInput],
+                     references: Sequence[list[SignWritingInput]]) -> float:
+        if not self.averages_sentence_scores():
+            return self.metric.corpus_score(hypotheses, references)
+        return super().corpus_score(hypotheses, references)
+
+    def corpus_statistics(self, hypotheses: list[SignWritingInput],
+                          references: list[list[SignWritingInput]]) -> list[list[float]]:
+        if not self.averages_sentence_scores():
+            return self.metric.corpus_statistics(hypotheses, references)
+        return super().corpus_statistics(hypotheses, references)  # the pairs of all segments are looked up at once
+
+    def corpus_score_from_statistics(self, statistics: list) -> float:
+        return self.metric.corpus_score_from_statistics(statistics)
@@ -1,15 +1,18 @@
+import itertools
 import math
-from functools import cache
-from typing import Tuple, Optional, NamedTuple
+from collections import defaultdict
+from typing import Iterator, Tuple, Optional, NamedTuple, Sequence, Union
 
 import numpy as np
 from scipy.optimize import linear_sum_assignment
 from signwriting.formats.fsw_to_sign import fsw_to_sign
-from signwriting.formats.swu_to_fsw import swu2fsw
-from signwriting.tokenizer import normalize_signwriting
 from signwriting.types import Sign, SignSymbol
+from tqdm import tqdm
 
-from signwriting_evaluation.metrics.base import SignWritingMetric
+from signwriting_evaluation.metrics.assignment import linear_sum_assignment_batch
+from signwriting_evaluation.metrics.base import SignWritingMetric, DEFAULT_CACHE_SIZE, push_top_k, sorted_top_k
+from signwriting_evaluation.metrics.parsed import ParsedSignWriting, SignWritingInput, normalized_signs, \
+    parse_signwriting
 
 
 class SymbolAttributes(NamedTuple):
@@ -29,18 +32,30 @@ SYMBOL_CLASSES = {
 }
 
 
-@cache
+# Symbols parsed from FSW have shapes up to S3ff
+NUM_SHAPES = 0x400
+
+
+def build_shape_class_index() -> np.ndarray:
+    shape_class_index = np.full(NUM_SHAPES, -1, dtype=np.int64)  # -1 for shapes outside all SYMBOL_CLASSES
+    for class_index, shapes in enumerate(SYMBOL_CLASSES.values()):
+        shape_class_index[shapes.start:shapes.stop] = class_index
+    return shape_class_index
+
+
+SHAPE_CLASS_INDEX = build_shape_class_index()
+
+
 def get_shape_class_index(shape: int) -> Optional[int]:
-    return next((i for i, r in enumerate(SYMBOL_CLASSES.values()) if shape in r), None)
+    class_index = int(SHAPE_CLASS_INDEX[shape])
+    return None if class_index < 0 else class_index
 
 
-@cache
 def text_to_signs(text: str) -> tuple[str, ...]:
-    text_as_fsw = swu2fsw(text)  # converts swu symbols to fsw, while keeping the fsw symbols if present
-    return tuple(normalize_signwriting(text_as_fsw).split(" "))
+    # The signs of a text, as parsed by parse_signwriting. Not cached: the metric caches the encoding of each text
+    return tuple(normalized_signs(text))
 
 
-@cache
 def get_symbol_attributes(symbol: str) -> SymbolAttributes:
     shape = int(symbol[1:4], 16)
     facing = int(symbol[4], 16)
@@ -49,7 +64,6 @@ def get_symbol_attributes(symbol: str) -> SymbolAttributes:
     return SymbolAttributes(shape, facing, angle, parallel)
 
 
-@cache
 def fast_positional_distance(pos1: Tuple[int, int], pos2: Tuple[int, int]) -> float:
     # Unbelievably, this is faster than using numpy or scipy for simple Euclidean distance
     # It reduces the overhead of converting to numpy arrays when calculating distances
@@ -70,29 +84,151 @@ ERROR_WEIGHT = {
 }
 
 
-@cache
+def build_symbol_distance_table() -> np.ndarray:
+    # The symbols distance only depends on the absolute shape difference, both facings, and the absolute angle
+    # difference, so it is tabulated by those (the full symbol-to-symbol table would take billions of cells)
+    facings = np.arange(6)
+    d_shape = np.arange(NUM_SHAPES - 0x100).reshape(-1, 1, 1, 1) * ERROR_WEIGHT["shape"]
+    d_facing = np.subtract.outer(facings, facings).reshape(1, 6, 6, 1) * ERROR_WEIGHT["facing"]
+    d_angle = np.arange(16).reshape(1, 1, 1, -1) * ERROR_WEIGHT["angle"]
+    d_parallel = np.not_equal.outer(facings > 2, facings > 2).reshape(1, 6, 6, 1) * ERROR_WEIGHT["parallel"]
+    return np.sqrt(d_shape * d_shape + \
+                   d_facing * d_facing + \
+                   d_angle * d_angle + \
+                   d_parallel * d_parallel)
+
+
+# Indexed by [abs(shape1 - shape2), facing1, facing2, abs(angle1 - angle2)]
+SYMBOL_DISTANCE = build_symbol_distance_table()
+
+
 def fast_symbol_distance(attributes1: SymbolAttributes, attributes2: SymbolAttributes) -> float:
-    d_shape = (attributes1.shape - attributes2.shape) * ERROR_WEIGHT["shape"]
-    d_facing = (attributes1.facing - attributes2.facing) * ERROR_WEIGHT["facing"]
-    d_angle = (attributes1.angle - attributes2.angle) * ERROR_WEIGHT["angle"]
-    d_parallel = (attributes1.parallel != attributes2.parallel) * ERROR_WEIGHT["parallel"]
-    return math.sqrt(d_shape * d_shape + \
-                     d_facing * d_facing + \
-                     d_angle * d_angle + \
-                     d_parallel * d_parallel)
+    return float(SYMBOL_DISTANCE[abs(attributes1.shape - attributes2.shape),
+                                 attributes1.facing,
+                                 attributes2.facing,
+                                 abs(attributes1.angle - attributes2.angle)])
+
+
+# Weights of the symbol attributes (shape, facing, angle, parallel), in the order of get_sign_attributes rows
+SYMBOL_ATTRIBUTES_WEIGHT = np.array([ERROR_WEIGHT["shape"],
+                                     ERROR_WEIGHT["facing"],
+                                     ERROR_WEIGHT["angle"],
+                                     ERROR_WEIGHT["parallel"]])
+
+# Candidates scored at once by top_k, between checks of their upper bounds against the current top k
+TOP_K_CHUNK_SIZE = 256
+# Margin of the upper bounds, for floating point errors
+TOP_K_TOLERANCE = 1e-9
+
+# Maximum number of cells in a batch of cost matrices, bounding the memory of batched scoring (8 MB per array)
+MAX_BATCH_CELLS = 2 ** 20
+
+
+def get_symbols_attributes(symbols: np.ndarray, positions: np.ndarray) -> np.ndarray:
+    # Encodes symbol ids (as in ParsedSignWriting) and their positions as a (7, num_symbols) array,
+    # with the rows: shape, facing, angle, parallel, x, y, class.
+    # Symbols with a shape outside all SYMBOL_CLASSES are marked with class -1
+    symbols = symbols.astype(np.int64)
+    shapes = symbols >> 8
+    facings = (symbols >> 4) & 0xF
+    angles = symbols & 0xF
+    return np.stack([shapes, facings, angles, facings > 2, positions[:, 0], positions[:, 1],
+                     SHAPE_CLASS_INDEX[shapes]]).astype(np.float64)
+
+
+def get_sign_attributes(sign: Sign) -> np.ndarray:
+    symbols = np.array([int(symbol["symbol"][1:6], 16) for symbol in sign["symbols"]], dtype=np.int64)
+    positions = np.array([symbol["position"] for symbol in sign["symbols"]], dtype=np.int64).reshape(-1, 2)
+    return get_symbols_attributes(symbols, positions)
+
+
+def get_parsed_signs_attributes(parsed: ParsedSignWriting) -> tuple[np.ndarray, ...]:
+    # Encodes each sign of a parsed text, as get_sign_attributes
+    return tuple(get_symbols_attributes(*parsed.sign_symbols(i)) for i in range(parsed.num_signs))
+
+
+def canonical_signs(parsed: ParsedSignWriting) -> str:
+    # The symbols of each sign, sorted, without the box of the sign. Texts of the same canonical signs have the same
+    # scores (up to floating point rounding), as symbols are matched by assignment, and boxes are not scored
+    signs = []
+    for i in range(parsed.num_signs):
+        symbols, positions = parsed.sign_symbols(i)
+        signs.append("".join(sorted(f"S{symbol:05x}{x}x{y}"
+                                    for symbol, (x, y) in zip(symbols.tolist(), positions.tolist()))))
+    return " ".join(signs)
+
+
+def text_canonical_signs(text: str) -> str:
+    return canonical_signs(parse_signwriting(text))
+
 
+def text_to_signs_attributes(text: str) -> tuple[np.ndarray, ...]:
+    signs_attributes = get_parsed_signs_attributes(parse_signwriting(text))
+    for attributes in signs_attributes:
+        attributes.flags.writeable = False  # cached, shared between calls
+    return signs_attributes
 
-fsw_to_sign = cache(fsw_to_sign)
 
+def length_error(hyp_len: Union[int, np.ndarray], ref_len: Union[int, np.ndarray]) -> Union[float, np.ndarray]:
+    # Difference of the numbers of symbols of two signs (or arrays of them), relative to the longest,
+    # plus 1 for the box symbol
+    return np.abs(hyp_len - ref_len) / (np.maximum(hyp_len, ref_len) + 1)
 
-class SignWritingSimilarityMetric(SignWritingMetric):
+
+def length_weight(hyp_len: Union[int, np.ndarray], ref_len: Union[int, np.ndarray]) -> Union[float, np.ndarray]:
+    # Weight of the length error in the error rate of two signs, the rest being their mean matching cost
+    return np.float_power(length_error(hyp_len, ref_len), ERROR_WEIGHT["exp_factor"])
+
+
+def single_sign_attributes(signs_attributes: Optional[tuple[np.ndarray, ...]]) -> Optional[np.ndarray]:
+    # Attributes of an encoded text containing a single sign, None otherwise
+    if signs_attributes is None or len(signs_attributes) != 1:
+        return None
+    return signs_attributes[0]
+
+
+def class_histogram(attributes: np.ndarray) -> np.ndarray:
+    # Number of symbols of each of the SYMBOL_CLASSES in a sign encoded by get_sign_attributes
+    shape_classes = attributes[6]
+    return np.bincount(shape_classes[shape_classes >= 0].astype(np.int64), minlength=len(SYMBOL_CLASSES))
+
+
+def group_by_length(signs_attributes: list[Optional[np.ndarray]]) -> dict[int, list[int]]:
+    # Indices of the encoded signs, grouped by number of symbols (skipping None)
+    groups = defaultdict(list)
+    for i, attributes in enumerate(signs_attributes):
+        if attributes is not None:
+            groups[attributes.shape[1]].append(i)
+    return groups
+
+
+def assignment_mean_cost(cost_matrices: np.ndarray) -> np.ndarray:
+    # Mean cost of the lowest cost matching, for each cost matrix in a (batch, rows, cols) array
+    row_ind, col_ind = linear_sum_assignment_batch(cost_matrices)
+    assigned_costs = cost_matrices[np.arange(len(cost_matrices))[:, np.newaxis], row_ind, col_ind]
+    return assigned_costs.mean(axis=-1)
+
+
+class SignWritingSimilarityMetric(SignWritingMetric):  # pylint: disable=too-many-public-methods
     SYMMETRIC = True
 
-    def __init__(self):
+    def __init__(self, cache_size: Optional[int] = DEFAULT_CACHE_SIZE):
         super().__init__("SymbolsDistances")
+        self.text_to_signs_attributes = self.cached(text_to_signs_attributes, cache_size)
+        self.text_canonical_signs = self.cached(text_canonical_signs, cache_size)
         self.max_distance = self.calculate_distance({"symbol": "S10000", "position": (250, 250)},
                                                     {"symbol": "S38b07", "position": (750, 750)})
 
+    def configuration(self) -> dict:
+        return {**super().configuration(), "error_weight": ERROR_WEIGHT, "symbol_classes": SYMBOL_CLASSES}
+
+    def canonical_text(self, text: Optional[SignWritingInput]) -> str:
+        if text is None:
+            return ""  # scored as 0, as texts without signs
+        if isinstance(text, ParsedSignWriting):
+            return canonical_signs(text)
+        return self.text_canonical_signs(text)
+
     def calculate_distance(self, hyp: SignSymbol, ref: SignSymbol) -> float:
         hyp_attributes = get_symbol_attributes(hyp['symbol'])
         ref_attributes = get_symbol_attributes(ref['symbol'])
@@ -120,27 +256,78 @@ class SignWritingSimilarityMetric(SignWritingMetric):
         normalized = self.normalized_distance(distance)
         return normalized
 
+    def signs_attributes(self, text: SignWritingInput) -> tuple[np.ndarray, ...]:
+        # Encoded signs of a text, cached by text for strings
+        if isinstance(text, ParsedSignWriting):
+            self.count("parsed_encodings")
+            return get_parsed_signs_attributes(text)
+        return self.text_to_signs_attributes(text)
+
+    def encode_texts(self, texts: Sequence[Optional[SignWritingInput]]) -> list[Optional[tuple[np.ndarray, ...]]]:
+        # Encoded signs of each text (None for None), so that parsed texts are encoded once per call
+        return [None if text is None else self.signs_attributes(text) for text in texts]
+
+    def distance_matrix(self, hyp: np.ndarray, ref: np.ndarray) -> np.ndarray:
+        # Vectorized calculate_distance for all symbol pairs of two signs encoded by get_sign_attributes.
+        return self.broadcast_distance(hyp[:, :, np.newaxis], ref[:, np.newaxis, :])
+
+    def broadcast_distance(self, hyp: np.ndarray, ref: np.ndarray) -> np.ndarray:
+        # Vectorized calculate_distance for attribute arrays (attributes on the first axis) that broadcast together.
+        # Operations are performed in the same order as the scalar version, to get exactly the same results.
+        diff = hyp - ref
+
+        weighted_diff = diff[:4] * SYMBOL_ATTRIBUTES_WEIGHT.reshape((4,) + (1,) * (diff.ndim - 1))
+        weighted_diff *= weighted_diff
+        symbols_distance = weighted_diff[0] + weighted_diff[1]
+        symbols_distance += weighted_diff[2]
+        symbols_distance += weighted_diff[3]
+        np.sqrt(symbols_distance, out=symbols_distance)
+
+        position_euclidean = np.sqrt(diff[4] * diff[4] + diff[5] * diff[5])
+        position_distance = ERROR_WEIGHT["positional"] * position_euclidean
+
+        class_penalty = np.abs(diff[6]) * ERROR_WEIGHT["class_penalty"]
+
+        distance = symbols_distance + position_distance + class_penalty
+
+        unknown_hyp_class = hyp[6] < 0
+        unknown_ref_class = ref[6] < 0
+        if unknown_hyp_class.any() or unknown_ref_class.any():
+            unknown_class = np.broadcast_to(unknown_hyp_class | unknown_ref_class, distance.shape)
+            distance[unknown_class] = self.max_distance
+
+        return distance
+
+    def normalized_distances(self, distances: np.ndarray) -> np.ndarray:
+        # Vectorized normalized_distance.
+        # np.power may use SIMD approximations, while np.float_power matches the builtin pow
+        return np.float_power(distances / self.max_distance, ERROR_WEIGHT["normalized_factor"])
+
+    def cost_matrix(self, hyp: np.ndarray, ref: np.ndarray) -> np.ndarray:
+        # Vectorized symbols_score for all symbol pairs of two signs encoded by get_sign_attributes.
+        return self.normalized_distances(self.distance_matrix(hyp, ref))
+
     def length_acc(self, hyp: Sign, ref: Sign) -> float:
-        hyp_len = len(hyp["symbols"])
-        ref_len = len(ref["symbols"])
-        # plus 1 for the box symbol
-        return abs(hyp_len - ref_len) / (max(hyp_len, ref_len) + 1)
+        return float(length_error(len(hyp["symbols"]), len(ref["symbols"])))
 
     def error_rate(self, hyp: Sign, ref: Sign) -> float:
         # Calculate the evaluate score for a given hypothesis and ref.
-        if not hyp["symbols"] or not ref["symbols"]:
+        return self.attributes_error_rate(get_sign_attributes(hyp), get_sign_attributes(ref))
+
+    def attributes_error_rate(self, hyp: np.ndarray, ref: np.ndarray) -> float:
+        # Same as error_rate, for signs encoded by get_sign_attributes
+        hyp_len = hyp.shape[1]
+        ref_len = ref.shape[1]
+        if hyp_len == 0 or ref_len == 0:
             return 1.0
 
-        cost_matrix = np.array(
-            [self.symbols_score(first, second) for first in hyp["symbols"] for second in ref["symbols"]])
-        cost_matrix = cost_matrix.reshape(len(hyp["symbols"]), -1)
+        cost_matrix = self.cost_matrix(hyp, ref)
         # Find the lowest cost matching
         row_ind, col_ind = linear_sum_assignment(cost_matrix)
         mean_cost = float(cost_matrix[row_ind, col_ind].mean())
 
-        length_error = self.length_acc(hyp, ref)
-        length_weight = pow(length_error, ERROR_WEIGHT["exp_factor"])
-        return length_weight + mean_cost * (1 - length_weight)
+        weight = float(length_weight(hyp_len, ref_len))
+        return weight + mean_cost * (1 - weight)
 
     def score_single_sign(self, hypothesis: str, reference: str) -> float:
         # Calculate the evaluate score for a given hypothesis and ref.
@@ -148,25 +335,185 @@ class SignWritingSimilarityMetric(SignWritingMetric):
         ref = fsw_to_sign(reference)
         return pow(1 - self.error_rate(hyp, ref), 2)
 
-    def score(self, hypothesis: Optional[str], reference: Optional[str]) -> float:
+    def score_sign_batch(self, hyps: np.ndarray, refs: np.ndarray) -> np.ndarray:
+        # Batched score_single_sign, for signs encoded by get_sign_attributes and stacked by number of symbols.
+        # hyps is (num_hyps, 7, hyp_len) and refs is (num_refs, 7, ref_len), returns (num_hyps, num_refs) scores
+        num_hyps, _, hyp_len = hyps.shape
+        num_refs, _, ref_len = refs.shape
+        if hyp_len == 0 or ref_len == 0:
+            return np.zeros((num_hyps, num_refs))
+
+        # (7, num_hyps, 1, hyp_len, 1) against (7, 1, num_refs, 1, ref_len)
+        hyps = hyps.transpose(1, 0, 2)[:, :, np.newaxis, :, np.newaxis]
+        refs = refs.transpose(1, 0, 2)[:, np.newaxis, :, np.newaxis, :]
+        with self.stage("cost_matrix"):
+            cost_matrices = self.normalized_distances(self.broadcast_distance(hyps, refs))
+        with self.stage("assignment"):
+            mean_costs = assignment_mean_cost(cost_matrices.reshape(-1, hyp_len, ref_len))
+        self.count("sign_pairs", num_hyps * num_refs)
+
+        # Same as attributes_error_rate, where the length weight is shared by the whole batch
+        weight = float(length_weight(hyp_len, ref_len))
+        error_rates = weight + mean_costs * (1 - weight)
+        return np.float_power(1 - error_rates, 2).reshape(num_hyps, num_refs)
+
+    def score(self, hypothesis: Optional[SignWritingInput], reference: Optional[SignWritingInput]) -> float:
         if hypothesis is None or reference is None:
             return 0.0
 
-        # Here, hypothesis and reference are both FSW strings of potentially different number of signs
-        hypothesis_signs = text_to_signs(hypothesis)
-        reference_signs = text_to_signs(reference)
+        # Here, hypothesis and reference are both SignWriting texts of potentially different number of signs
+        return self.score_encoded(self.signs_attributes(hypothesis), self.signs_attributes(reference))
+
+    def score_encoded(self, hypothesis_signs: Optional[Sequence[np.ndarray]],
+                      reference_signs: Optional[Sequence[np.ndarray]]) -> float:
+        # Same as score, for texts encoded by signs_attributes
+        if hypothesis_signs is None or reference_signs is None:
+            return 0.0
         if len(hypothesis_signs) == 1 and len(reference_signs) == 1:
-            return self.score_single_sign(hypothesis_signs[0], reference_signs[0])
-
-        # Pad with empty strings to make sure the number of signs is the same
-        if len(hypothesis_signs) != len(reference_signs):
-            max_length = max(len(hypothesis_signs), len(reference_signs))
-            hypothesis_signs += tuple([None] * (max_length - len(hypothesis_signs)))
-            reference_signs += tuple([None] * (max_length - len(reference_signs)))
-
-        # Match each hypothesis sign with each reference sign
-        cost_matrix = self.score_all(hypothesis_signs, reference_signs, progress_bar=False)
-        cost_matrix = np.array(cost_matrix)
-        row_ind, col_ind = linear_sum_assignment(1 - cost_matrix)
-        mean_score = cost_matrix[row_ind, col_ind].mean()
-        return float(mean_score)
+            return pow(1 - self.attributes_error_rate(hypothesis_signs[0], reference_signs[0]), 2)
+        return self.score_sentence(hypothesis_signs, reference_signs)
+
+    def score_sentence(self, hypothesis_signs: Sequence[np.ndarray], reference_signs: Sequence[np.ndarray]) -> float:
+        # Match each hypothesis sign with each reference sign, where all pairs are scored in batches.
+        # The shorter sentence is padded with empty signs, which score 0 against any sign, so they are not scored
+        num_signs = max(len(hypothesis_signs), len(reference_signs))
+        scores = np.zeros((num_signs, num_signs))
+        for hyp_indices, ref_indices, group_scores in self.score_groups(hypothesis_signs, reference_signs):
+            scores[np.ix_(hyp_indices, ref_indices)] = group_scores
+
+        with self.stage("sentence_assignment"):
+            row_ind, col_ind = linear_sum_assignment(1 - scores)
+        return float(scores[row_ind, col_ind].mean())
+
+    def score_group(self, hyps: list[np.ndarray], refs: list[np.ndarray]) -> np.ndarray:
+        # Scores of all pairs of single signs, all hyps having the same number of symbols, and all refs as well
+        if len(hyps) == 1 and len(refs) == 1:  # batching overhead is not worth it
+            return np.array([[pow(1 - self.attributes_error_rate(hyps[0], refs[0]), 2)]])
+
+        scores = np.empty((len(hyps), len(refs)))
+        matrix_cells = max(hyps[0].shape[1] * refs[0].shape[1], 1)
+        refs_chunk_size = max(1, MAX_BATCH_CELLS // matrix_cells)
+        for refs_start in range(0, len(refs), refs_chunk_size):
+            refs_chunk = np.stack(refs[refs_start:refs_start + refs_chunk_size])
+            hyps_chunk_size = max(1, MAX_BATCH_CELLS // (matrix_cells * len(refs_chunk)))
+            for hyps_start in range(0, len(hyps), hyps_chunk_size):
+                hyps_chunk = np.stack(hyps[hyps_start:hyps_start + hyps_chunk_size])
+                scores[hyps_start:hyps_start + len(hyps_chunk), refs_start:refs_start + len(refs_chunk)] = \
+                    self.score_sign_batch(hyps_chunk, refs_chunk)
+        return scores
+
+    def score_groups(self, hyp_attributes: Sequence[Optional[np.ndarray]],
+                     ref_attributes: Sequence[Optional[np.ndarray]]) -> Iterator[tuple[list, list, np.ndarray]]:
+        # Scores of all pairs of encoded single signs (skipping None), yielded for each group of hyps and refs
+        # having the same number of symbols, as (hyp_indices, ref_indices, scores)
+        hyp_groups = group_by_length(hyp_attributes)
+        ref_groups = group_by_length(ref_attributes)
+        for ref_indices in ref_groups.values():
+            refs = [ref_attributes[j] for j in ref_indices]
+            for hyp_indices in hyp_groups.values():
+                hyps = [hyp_attributes[i] for i in hyp_indices]
+                yield hyp_indices, ref_indices, self.score_group(hyps, refs)
+
+    def score_all(self, hypotheses: Sequence[Optional[SignWritingInput]],
+                  references: Sequence[Optional[SignWritingInput]],
+                  progress_bar=True, n_jobs: Optional[int] = 1,
+                  as_array=False, *, deduplicate=True) -> Union[list[list[float]], np.ndarray]:
+        # Texts are encoded once, and single signs are grouped by number of symbols,
+        # to compute the cost matrices of every group of pairs in one vectorized step.
+        # pylint: disable=too-many-arguments
+        scores = self.dispatch_score_all(hypotheses, references, progress_bar, n_jobs, deduplicate)
+        if scores is not None:
+            return scores if as_array else scores.tolist()
+
+        with self.stage("encode"):
+            hyp_encoded = self.encode_texts(hypotheses)
+            ref_encoded = self.encode_texts(references)
+        return self.score_all_encoded(hyp_encoded, ref_encoded, progress_bar, as_array)
+
+    def score_all_encoded(self, hyp_encoded: Sequence[Optional[tuple[np.ndarray, ...]]],
+                          ref_encoded: Sequence[Optional[tuple[np.ndarray, ...]]],
+                          progress_bar=True, as_array=False) -> Union[list[list[float]], np.ndarray]:
+        # Same as score_all (with deduplicate=False, in this process), for texts encoded by encode_texts
+        # pylint: disable=too-many-locals
+        scores = np.empty((len(hyp_encoded), len(ref_encoded)))
+        pbar = tqdm(total=scores.size, disable=not progress_bar or scores.size <= 1)
+
+        hyp_attributes = [single_sign_attributes(encoded) for encoded in hyp_encoded]
+        ref_attributes = [single_sign_attributes(encoded) for encoded in ref_encoded]
+
+        # Texts of multiple signs (or None) are scored one pair at a time
+        hyp_others = [i for i, attributes in enumerate(hyp_attributes) if attributes is None]
+        hyp_signs = [i for i, attributes in enumerate(hyp_attributes) if attributes is not None]
+        ref_others = [j for j, attributes in enumerate(ref_attributes) if attributes is None]
+        other_pairs = itertools.chain(itertools.product(hyp_others, range(len(ref_encoded))),
+                                      itertools.product(hyp_signs, ref_others))
+        self.count("sentence_pairs", len(hyp_others) * len(ref_encoded) + len(hyp_signs) * len(ref_others))
+        with self.stage("score_sentences"):
+            for i, j in other_pairs:
+                scores[i, j] = self.score_encoded(hyp_encoded[i], ref_encoded[j])
+                pbar.update(1)
+
+        for hyp_indices, ref_indices, group_scores in self.score_groups(hyp_attributes, ref_attributes):
+            scores[np.ix_(hyp_indices, ref_indices)] = group_scores
+            pbar.update(group_scores.size)
+
+        pbar.close()
+        return scores if as_array else scores.tolist()
+
+    def score_upper_bounds(self, attributes: np.ndarray, lengths: np.ndarray, histograms: np.ndarray) -> np.ndarray:
+        # Upper bounds of score_single_sign, between a sign and signs with the given number of symbols and
+        # class histograms, without matching: the length weight is exact, and for the mean cost,
+        # every matched pair of symbols from different classes costs at least the normalized class penalty
+        hyp_len = attributes.shape[1]
+        weights = length_weight(hyp_len, lengths)
+
+        num_matched = np.minimum(hyp_len, lengths)
+        num_same_class = np.minimum(class_histogram(attributes), histograms).sum(axis=1)
+        min_class_cost = pow(ERROR_WEIGHT["class_penalty"] / self.max_distance, ERROR_WEIGHT["normalized_factor"])
+        min_mean_cost = (num_matched - num_same_class) * min_class_cost / np.maximum(num_matched, 1)
+
+        error_rates = weights + min_mean_cost * (1 - weights)
+        bounds = np.float_power(1 - error_rates, 2)
+        bounds[num_matched == 0] = 0  # signs without symbols
+        return bounds
+
+    def top_k(self, queries: Sequence[Optional[SignWritingInput]], corpus: Sequence[Optional[SignWritingInput]], k=10,
+              progress_bar=True) -> tuple[list[list[int]], list[list[float]]]:
+        # Candidates are scored in order of their upper bound (score_upper_bounds),
+        # until no remaining candidate can enter the top k of the query.
+        # Queries and corpus entries with multiple signs (or None) have no bound, and are always scored.
+        # pylint: disable=too-many-locals
+        corpus_encoded = self.encode_texts(corpus)
+        corpus_attributes = [single_sign_attributes(encoded) for encoded in corpus_encoded]
+        lengths = np.array([0 if a is None else a.shape[1] for a in corpus_attributes], dtype=np.int64)
+        histograms = np.zeros((len(corpus), len(SYMBOL_CLASSES)), dtype=np.int64)
+        for j, attributes in enumerate(corpus_attributes):
+            if attributes is not None:
+                histograms[j] = class_histogram(attributes)
+        unbounded = np.array([a is None for a in corpus_attributes], dtype=bool)
+
+        all_indices, all_scores = [], []
+        for query in tqdm(queries, disable=not progress_bar or len(queries) <= 1):
+            query_encoded = self.encode_texts([query])
+            query_attributes = single_sign_attributes(query_encoded[0])
+            if query_attributes is None:
+                bounds = np.ones(len(corpus))
+            else:
+                bounds = self.score_upper_bounds(query_attributes, lengths, histograms)
+                bounds[unbounded] = 1
+            order = np.argsort(-bounds, kind="stable")
+
+            heap = []
+            for start in range(0, len(order), TOP_K_CHUNK_SIZE):
+                candidates = order[start:start + TOP_K_CHUNK_SIZE]
+                if k <= 0 or (len(heap) == k and bounds[candidates[0]] + TOP_K_TOLERANCE < heap[0][0]):
+                    break  # no remaining candidate can enter the top k (nothing to find for k <= 0)
+                scores = self.score_all_encoded(query_encoded, [corpus_encoded[j] for j in candidates],
+                                                progress_bar=False, as_array=True)
+                for j, score in zip(candidates.tolist(), scores[0].tolist()):
+                    push_top_k(heap, k, score, j)
+
+            indices, scores = sorted_top_k(heap)
+            all_indices.append(indices)
+            all_scores.append(scores)
+        return all_indices, all_scores
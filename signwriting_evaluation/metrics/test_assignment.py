@@ -0,0 +1,34 @@
+import unittest
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+from signwriting_evaluation.metrics.assignment import linear_sum_assignment_batch, assignment_permutations
+
+
+class TestAssignment(unittest.TestCase):
+    def test_permutations(self):
+        self.assertEqual(assignment_permutations(2, 3).tolist(), [[0, 1], [0, 2], [1, 0], [1, 2], [2, 0], [2, 1]])
+        self.assertEqual(assignment_permutations(0, 2).shape, (1, 0))
+
+    def test_matches_scipy(self):
+        rng = np.random.default_rng(0)
+        # Small shapes are solved by trying all matchings, and larger ones (or small batches) by scipy
+        for shape in [(1, 1), (2, 3), (3, 2), (4, 4), (5, 5), (6, 6), (8, 3), (3, 8)]:
+            for num_matrices in [1, 50]:
+                cost_matrices = rng.random((num_matrices, *shape))
+                row_ind, col_ind = linear_sum_assignment_batch(cost_matrices)
+                self.assertEqual(row_ind.shape, (num_matrices, min(shape)))
+                for cost_matrix, rows, cols in zip(cost_matrices, row_ind, col_ind):
+                    expected_rows, expected_cols = linear_sum_assignment(cost_matrix)
+                    self.assertEqual(rows.tolist(), expected_rows.tolist())
+                    self.assertEqual(cols.tolist(), expected_cols.tolist())
+
+    def test_empty(self):
+        row_ind, col_ind = linear_sum_assignment_batch(np.zeros((5, 0, 3)))
+        self.assertEqual(row_ind.shape, (5, 0))
+        self.assertEqual(col_ind.shape, (5, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
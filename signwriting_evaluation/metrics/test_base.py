@@ -0,0 +1,183 @@
+import pickle
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+from signwriting_evaluation.metrics.base import SignWritingMetric, CachedFunction, array_top_k, push_top_k, \
+    read_lines, sorted_top_k
+
+
+class LengthRatioMetric(SignWritingMetric):
+    SYMMETRIC = True
+
+    def __init__(self):
+        super().__init__(name="LengthRatio")
+
+    def score(self, hypothesis: str, reference: str) -> float:
+        return min(len(hypothesis), len(reference)) / max(len(hypothesis), len(reference))
+
+
+class StagedLengthRatioMetric(LengthRatioMetric):
+    def score(self, hypothesis: str, reference: str) -> float:
+        self.count("pairs")
+        with self.stage("ratio"):
+            return super().score(hypothesis, reference)
+
+
+class CachedLengthRatioMetric(LengthRatioMetric):
+    def __init__(self):
+        super().__init__()
+        self.text_length = self.cached(len, maxsize=2)
+
+    def score(self, hypothesis: str, reference: str) -> float:
+        return min(self.text_length(hypothesis), self.text_length(reference)) / \
+            max(self.text_length(hypothesis), self.text_length(reference))
+
+
+class PrefixMetric(SignWritingMetric):
+    def __init__(self):
+        super().__init__(name="Prefix")
+
+    def score(self, hypothesis: str, reference: str) -> float:
+        return float(reference.startswith(hypothesis))
+
+
+class TestSignWritingMetric(unittest.TestCase):
+    def setUp(self):
+        self.texts = ["M500x500", "M500x500S10000", "M500x500S10000S20000", "M518x529S14c20481x471", "S1"] * 3
+
+    def test_parallel_score_all_equals_serial(self):
+        metric = PrefixMetric()
+        serial = metric.score_all(self.texts, self.texts[:7], progress_bar=False)
+        parallel = metric.score_all(self.texts, self.texts[:7], progress_bar=False, n_jobs=2)
+        self.assertEqual(serial, parallel)
+
+    def test_parallel_score_self_equals_serial(self):
+        for metric in [LengthRatioMetric(), PrefixMetric()]:
+            serial = metric.score_self(self.texts, progress_bar=False)
+            parallel = metric.score_self(self.texts, progress_bar=False, n_jobs=2)
+            self.assertEqual(serial, parallel, msg=metric.name)
+
+    def test_score_self_as_array(self):
+        for metric in [LengthRatioMetric(), PrefixMetric()]:
+            scores = metric.score_self(self.texts, progress_bar=False, as_array=True)
+            self.assertIsInstance(scores, np.ndarray)
+            self.assertEqual(scores.dtype, np.float16)
+            expected = np.array(metric.score_all(self.texts, self.texts, progress_bar=False), dtype=np.float16)
+            np.testing.assert_array_equal(scores, expected)
+
+    def test_score_self_memory_mapped(self):
+        metric = LengthRatioMetric()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            output_path = Path(temp_dir) / "scores.npy"
+            scores = metric.score_self(self.texts, progress_bar=False, output_path=output_path)
+            self.assertIsInstance(scores, np.memmap)
+            loaded = np.load(output_path, mmap_mode="r")
+            np.testing.assert_array_equal(loaded, metric.score_self(self.texts, progress_bar=False))
+            del scores, loaded
+
+    def test_top_k(self):
+        metric = LengthRatioMetric()
+        indices, scores = metric.top_k(self.texts[:2], self.texts, k=4, progress_bar=False)
+        all_scores = metric.score_all(self.texts[:2], self.texts, progress_bar=False)
+        for query_indices, query_scores, row in zip(indices, scores, all_scores):
+            expected = sorted(range(len(row)), key=row.__getitem__, reverse=True)[:4]
+            self.assertEqual(query_indices, expected)
+            self.assertEqual(query_scores, [row[j] for j in expected])
+
+        for k in [0, -1]:
+            self.assertEqual(metric.top_k(self.texts[:2], self.texts, k=k, progress_bar=False), ([[], []], [[], []]))
+
+    def test_array_top_k_matches_heap(self):
+        scores = np.random.default_rng(0).integers(0, 5, size=50) / 4  # many ties
+        for k in [-1, 0, 1, 7, 50, 60]:
+            heap = []
+            for j, score in enumerate(scores.tolist()):
+                push_top_k(heap, k, score, j)
+            self.assertEqual(array_top_k(scores, k), sorted_top_k(heap))
+
+    def test_cached_function_is_bounded(self):
+        cached_len = CachedFunction(len, maxsize=2)
+        for text in ["a", "bb", "a", "ccc", "a"]:
+            self.assertEqual(cached_len(text), len(text))
+        info = cached_len.cache_info()
+        self.assertEqual((info.hits, info.misses, info.currsize), (2, 3, 2))
+
+        restored = pickle.loads(pickle.dumps(cached_len))
+        self.assertEqual(restored("bb"), 2)
+        self.assertEqual(restored.cache_info().currsize, 1)  # contents are not pickled
+
+    def test_caches_fit_the_corpus(self):
+        # Blocks of rows are scored against the whole corpus, whose texts are then computed once each,
+        # and the caches are bounded again afterwards
+        metric = CachedLengthRatioMetric()
+        texts = [f"M500x500{'S10000' * i}" for i in range(20)]
+        scores = metric.score_self(texts, progress_bar=False, as_array=True)
+        np.testing.assert_array_equal(scores, LengthRatioMetric().score_self(texts, progress_bar=False, as_array=True))
+        info = metric.cache_info()["len"]
+        self.assertEqual((info.misses, info.maxsize, info.currsize), (len(texts), 2, 0))
+
+    def test_instrumentation(self):
+        metric = StagedLengthRatioMetric()
+        metric.score_all(self.texts, self.texts[:4], progress_bar=False)
+        self.assertEqual(metric.instrumentation_report()["stages"], {})  # disabled by default
+
+        timed = []
+        metric.enable_instrumentation(callback=lambda stage, seconds: timed.append(stage))
+        metric.score_all(self.texts, self.texts[:4], progress_bar=False, deduplicate=False)
+        report = metric.instrumentation_report()
+        self.assertEqual(report["stages"]["ratio"]["calls"], len(self.texts) * 4)
+        self.assertGreaterEqual(report["stages"]["ratio"]["seconds"], 0)
+        self.assertEqual(report["counters"], {"pairs": len(self.texts) * 4})
+        self.assertEqual(timed, ["ratio"] * len(self.texts) * 4)
+
+        # Pickled (e.g. to worker processes) without the callback
+        restored = pickle.loads(pickle.dumps(metric))
+        self.assertIsNone(restored.instrumentation.callback)
+
+        metric.disable_instrumentation()
+        metric.score("M500x500", "S1")
+        self.assertEqual(metric.instrumentation_report()["counters"], {})
+
+    def test_deduplicated_score_all(self):
+        for metric in [StagedLengthRatioMetric(), PrefixMetric()]:
+            expected = metric.score_all(self.texts, self.texts[:7], progress_bar=False, deduplicate=False)
+            self.assertEqual(metric.score_all(self.texts, self.texts[:7], progress_bar=False), expected)
+            self.assertEqual(metric.score_all(self.texts, self.texts[:7], progress_bar=False, n_jobs=2), expected)
+
+        # Each distinct pair is scored once, and a pair of a symmetric metric in one order only
+        metric = StagedLengthRatioMetric()
+        metric.enable_instrumentation()
+        metric.score_all(self.texts, self.texts[:7], progress_bar=False)
+        counters = metric.instrumentation_report()["counters"]
+        self.assertEqual(counters, {"pairs": 5 * 4 // 2 + 5, "deduplicated_pairs": len(self.texts) * 7 - 5 * 5})
+
+        references = [self.texts[::-1], self.texts[1:] + self.texts[:1]]
+        expected = metric.score_all(self.texts, references[0] + references[1], progress_bar=False)
+        expected = [max(row[i], row[len(self.texts) + i]) for i, row in enumerate(expected)]
+        metric.enable_instrumentation()
+        self.assertAlmostEqual(metric.corpus_score(self.texts, references), sum(expected) / len(self.texts))
+        self.assertEqual(metric.instrumentation_report()["counters"]["pairs"], 7)  # distinct pairs of both references
+
+    def test_stream_corpus_score(self):
+        metric = LengthRatioMetric()
+        references = [self.texts[::-1], self.texts[1:] + self.texts[:1]]
+        expected = metric.corpus_score(self.texts, references)
+        streamed = metric.stream_corpus_score(iter(self.texts), [iter(r) for r in references], chunk_size=4)
+        self.assertEqual(streamed, expected)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            paths = [Path(temp_dir) / f"{name}.txt" for name in ["hypotheses", "references"]]
+            for path, lines in zip(paths, [self.texts, references[0]]):
+                path.write_text("".join(f"{line}\n" for line in lines), encoding="utf-8")
+            streamed = metric.stream_corpus_score(read_lines(paths[0]), [read_lines(paths[1])])
+            self.assertEqual(streamed, metric.corpus_score(self.texts, references[:1]))
+
+        with self.assertRaises(AssertionError):
+            metric.stream_corpus_score(iter(self.texts), [iter(self.texts[:-1])])
+
+
+if __name__ == '__main__':
+    unittest.main()
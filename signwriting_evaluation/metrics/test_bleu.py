@@ -1,6 +1,7 @@
 import unittest
 
 from signwriting_evaluation.metrics.bleu import SignWritingBLEU
+from signwriting_evaluation.metrics.parsed import parse_signwriting
 
 
 class TestSignWritingBLEU(unittest.TestCase):
@@ -14,6 +15,34 @@ class TestSignWritingBLEU(unittest.TestCase):
         self.assertIsInstance(score, float)  # Check if the score is a float
         self.assertAlmostEqual(score, 0.126835469)
 
+    def test_score_all_matches_sacrebleu(self):
+        texts = [
+            "M530x538S37602508x462S15a11493x494S20e00488x510S22f03469x517",
+            "M519x534S37900497x466S3770b497x485S15a51491x501S22f03481x513",
+            "M519x534S37900497x466S3770b497x485 M530x538S37602508x462S15a11493x494",
+            "M508x515S10000492x485",
+            "",
+        ]
+        hypotheses = texts + [parse_signwriting(texts[2])]
+        scores = self.metric.score_all(hypotheses, texts)
+        for hypothesis, hyp_scores in zip(hypotheses, scores):
+            hypothesis = self.metric.tokenize(hypothesis)
+            for reference, score in zip(texts, hyp_scores):
+                expected = self.metric.bleu.sentence_score(hypothesis, [self.metric.tokenize(reference)]).score / 100
+                self.assertEqual(score, expected)
+
+        # Each distinct string is tokenized and counted once
+        self.assertEqual(self.metric.cache_info()["tokenize_text"].misses, len(texts))
+        self.assertEqual(self.metric.cache_info()["tokens_ngram_statistics"].misses, len(texts))
+
+    def test_instrumentation_report(self):
+        self.metric.enable_instrumentation()
+        texts = ["M508x515S10000492x485", "M519x534S37900497x466S3770b497x485"]
+        self.metric.score_all(texts, texts)
+        report = self.metric.instrumentation_report()
+        self.assertEqual(set(report["stages"]), {"tokenize", "sentence_bleu"})
+        self.assertEqual(report["caches"]["tokens_ngram_statistics"]["hit_rate"], 0.5)
+
     def test_corpus_score_wrong_order_errors(self):
         hypothesis = "M530x538S37602508x462S15a11493x494S20e00488x510S22f03469x517"
         reference = "M519x534S37900497x466S3770b497x485S15a51491x501S22f03481x513"
@@ -23,6 +52,18 @@ class TestSignWritingBLEU(unittest.TestCase):
         with self.assertRaises(AssertionError):
             self.metric.corpus_score(hypotheses, references)
 
+    def test_stream_corpus_score(self):
+        hypotheses = [
+            "M530x538S37602508x462S15a11493x494S20e00488x510S22f03469x517",
+            "M519x534S37900497x466S3770b497x485 M530x538S37602508x462S15a11493x494",
+            "M508x515S10000492x485",
+        ] * 3
+        references = [hypotheses[1:] + hypotheses[:1], hypotheses[::-1]]
+        expected = self.metric.corpus_score(hypotheses, references)
+        streamed = self.metric.stream_corpus_score((h for h in hypotheses), [iter(r) for r in references],
+                                                   chunk_size=2)
+        self.assertEqual(streamed, expected)
+
 
 if __name__ == '__main__':
     unittest.main()
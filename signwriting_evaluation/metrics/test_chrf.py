@@ -1,6 +1,9 @@
 import unittest
 
-from signwriting_evaluation.metrics.chrf import SignWritingCHRF
+import numpy as np
+
+from signwriting_evaluation.metrics.chrf import SignWritingCHRF, chrf_block
+from signwriting_evaluation.metrics.parsed import parse_signwriting
 
 
 class TestSignWritingCHRF(unittest.TestCase):
@@ -14,6 +17,43 @@ class TestSignWritingCHRF(unittest.TestCase):
         self.assertIsInstance(score, float)  # Check if the score is a float
         self.assertAlmostEqual(score, 0.293473597)
 
+    def test_score_all_matches_sacrebleu(self):
+        # Including texts shorter than the n-gram orders
+        texts = [
+            "M508x515S10000492x485",
+            "M530x538S37602508x462S15a11493x494S20e00488x510S22f03469x517",
+            "M519x534S37900497x466S3770b497x485 M530x538S37602508x462S15a11493x494",
+            "M519x534S37900497x466S3770b497x485S15a51491x501S22f03481x513",
+            "",
+            "M5",
+        ]
+        hypotheses = texts + [parse_signwriting(texts[2])]
+        scores = self.metric.score_all(hypotheses, texts)
+        for hypothesis, hyp_scores in zip(hypotheses, scores):
+            for reference, score in zip(texts, hyp_scores):
+                self.assertEqual(score, self.metric.score(hypothesis, reference))
+
+        # Each distinct string is extracted once
+        self.assertEqual(self.metric.cache_info()["text_char_ngrams"].misses, len(texts))
+
+        # The matrices of all texts are built once, for every block of rows
+        self.metric.enable_instrumentation()
+        self_scores = self.metric.score_self(texts, as_array=True)
+        np.testing.assert_array_equal(self_scores, np.array(scores[:len(texts)], dtype=np.float16))
+        self.assertEqual(self.metric.instrumentation_report()["stages"]["matrices"]["calls"], 1)
+
+        matrices, hyp_totals, ref_totals = self.metric.ngram_matrices(hypotheses, texts)
+        block = chrf_block(matrices, range(2, 5), hyp_totals, ref_totals, ref_start=3)
+        np.testing.assert_array_equal(block, np.array(scores)[2:5, 3:])
+
+    def test_stream_corpus_score(self):
+        signs = ["M508x515S10000492x485", "M519x534S37900497x466S3770b497x485", "M530x538S37602508x462S15a11493x494"]
+        hypotheses = [" ".join(signs[:n]) for n in range(1, 4)] + signs
+        references = [signs + signs[::-1]]
+
+        # Generators are consumed one chunk of 4 lines at a time
+        streamed = self.metric.stream_corpus_score((h for h in hypotheses), [iter(references[0])], chunk_size=4)
+        self.assertEqual(streamed, self.metric.corpus_score(hypotheses, references))
 
 if __name__ == '__main__':
     unittest.main()
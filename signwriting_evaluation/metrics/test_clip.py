@@ -1,9 +1,15 @@
+import tempfile
 import unittest
 
+import diskcache
 import numpy as np
 from PIL import Image
 
-from signwriting_evaluation.metrics.clip import SignWritingCLIPScore, signwriting_to_clip_image
+from signwriting.formats.fsw_to_swu import fsw2swu
+
+from signwriting_evaluation.metrics.clip import SignWritingCLIPScore, signwriting_to_clip_image, canonical_fsw, \
+    disk_cache_contains, quantization_deviation
+from signwriting_evaluation.metrics.embedding_store import EmbeddingStore
 
 
 class TestSignWritingCLIPScore(unittest.TestCase):
@@ -24,11 +30,100 @@ class TestSignWritingCLIPScore(unittest.TestCase):
         self.assertIsInstance(score, float)  # Check if the score is a float
         self.assertAlmostEqual(score, 0.7759, places=2)
 
+    def test_score_all_with_rendering_processes(self):
+        signs = [f"M530x538S{shape:03x}00508x462S15a11493x494" for shape in range(0x100, 0x120)]
+        metric = SignWritingCLIPScore(cache_directory=None)
+        scores = metric.score_all(signs, signs[:3], progress_bar=False, n_jobs=2)
+        expected = self.metric.score_all(signs, signs[:3], progress_bar=False)
+        np.testing.assert_allclose(scores, expected, atol=1e-5)
+
+    def test_score_self_computes_features_once(self):
+        signs = [f"M530x538S{shape:03x}00508x462S15a11493x494" for shape in range(0x100, 0x120)]
+        expected = self.metric.score_all(signs, signs, progress_bar=False)
+        with tempfile.TemporaryDirectory() as cache_directory:
+            metric = SignWritingCLIPScore(cache_directory=cache_directory, cache_format="mmap")
+            for as_array in [False, True]:
+                scores = metric.score_self(signs, progress_bar=False, n_jobs=2, as_array=as_array)
+                np.testing.assert_allclose(scores, expected, atol=1e-3)  # float16 as an array
+            self.assertEqual(len(EmbeddingStore(cache_directory)), len(signs))
+
+    def test_quantization_report_of_a_quantized_store(self):
+        signs = [f"M530x538S{shape:03x}00508x462S15a11493x494" for shape in range(0x100, 0x120)]
+        with tempfile.TemporaryDirectory() as cache_directory:
+            metric = SignWritingCLIPScore(cache_directory=cache_directory, cache_format="mmap", cache_dtype="int8")
+            float16_report, int8_report = metric.quantization_report(signs, progress_bar=False)
+            self.assertLess(float16_report["max_deviation"], int8_report["max_deviation"])
+            self.assertGreater(int8_report["max_deviation"], 0)  # from float32 features
+            self.assertEqual(len(metric.cache), 0)  # computed without the store
+
+    def test_top_k_matches_score_all(self):
+        signs = [f"M530x538S{shape:03x}00508x462S15a11493x494" for shape in range(0x100, 0x110)]
+        all_scores = self.metric.score_all(signs[:3], signs, progress_bar=False, as_array=True)
+        self.assertEqual(all_scores.shape, (3, len(signs)))
+        indices, scores = self.metric.top_k(signs[:3], signs, k=4, progress_bar=False)
+        for query_indices, query_scores, row in zip(indices, scores, all_scores.tolist()):
+            expected = sorted(range(len(row)), key=row.__getitem__, reverse=True)[:4]
+            self.assertEqual(query_indices, expected)
+            self.assertEqual(query_scores, [row[j] for j in expected])
+
+    def test_same_renders_share_features(self):
+        signs = ["M530x538S37602508x462S15a11493x494", "L540x548S37602518x472S15a11503x504",
+                 Image.new("RGB", (5, 50), (255, 255, 255)), Image.new("RGBA", (50, 5), (0, 0, 0, 0))]
+        metric = SignWritingCLIPScore(cache_directory=None)
+        scores = metric.score_all(signs, signs, progress_bar=False, as_array=True)
+        self.assertEqual(len(metric.cache), 2)
+        np.testing.assert_array_equal(scores[0], scores[1])
+        np.testing.assert_array_equal(scores[2], scores[3])
+
     def test_bad_fsw_is_not_an_empty_image(self):
         fsw = "M530x538S37602531x539"
         image = signwriting_to_clip_image(fsw)
         self.assertTrue(np.any(np.array(image) != 255))
 
 
+class TestCanonicalFsw(unittest.TestCase):
+    def test_renders_the_same_image(self):
+        fsw = "M530x538S37602508x462S15a11493x494S20e00488x510"
+        translated = "L600x600S37602528x472S15a11513x504S20e00508x520"
+        self.assertEqual(canonical_fsw(fsw), "S37602520x500S15a11505x532S20e00500x548")
+        self.assertEqual(canonical_fsw(translated), canonical_fsw(fsw))
+        self.assertEqual(canonical_fsw(fsw2swu(fsw)), canonical_fsw(fsw))
+        np.testing.assert_array_equal(signwriting_to_clip_image(canonical_fsw(fsw)), signwriting_to_clip_image(fsw))
+
+    def test_symbol_order_is_kept(self):
+        # Overlapping symbols render differently in another order
+        self.assertNotEqual(canonical_fsw("M530x538S10000490x490S15a11495x495"),
+                            canonical_fsw("M530x538S15a11495x495S10000490x490"))
+
+    def test_no_symbols(self):
+        self.assertEqual(canonical_fsw("M500x500"), "")
+        self.assertEqual(canonical_fsw(""), "")
+
+
+class TestDiskCacheContains(unittest.TestCase):
+    def test_finds_cached_keys(self):
+        with tempfile.TemporaryDirectory() as cache_directory:
+            with diskcache.Cache(cache_directory) as cache:
+                keys = [f"M500x500S{shape:03x}00500x500" for shape in range(0x100, 0x500)]
+                for key in keys[::3]:
+                    cache[key] = np.zeros(2)
+                cache.set(keys[1], np.zeros(2), expire=-1)  # already expired
+                self.assertEqual(disk_cache_contains(cache, keys + ["missing"]), set(keys[::3]))
+                self.assertEqual(disk_cache_contains(cache, []), set())
+
+
+class TestQuantizationDeviation(unittest.TestCase):
+    def test_deviation(self):
+        features = np.random.default_rng(0).normal(size=(100, 512)).astype(np.float32)
+        features /= np.linalg.norm(features, axis=1, keepdims=True)
+        float32_report = quantization_deviation(features, "float32")
+        self.assertEqual((float32_report["max_deviation"], float32_report["top_k_overlap"]), (0, 1))
+
+        int8_report = quantization_deviation(features, "int8")
+        self.assertEqual(int8_report["bytes_per_vector"], 512 + 4)
+        self.assertLess(int8_report["max_deviation"], 0.01)
+        self.assertLess(quantization_deviation(features, "float16")["max_deviation"], int8_report["max_deviation"])
+
+
 if __name__ == '__main__':
     unittest.main()
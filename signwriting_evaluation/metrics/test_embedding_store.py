@@ -0,0 +1,94 @@
+import tempfile
+import unittest
+
+import numpy as np
+
+from signwriting_evaluation.metrics.embedding_store import EmbeddingStore, quantize, dequantize
+
+
+class TestEmbeddingStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.keys = [f"M500x500S{shape:03x}00500x500" for shape in range(0x100, 0x110)]
+        self.embeddings = np.random.default_rng(0).random((len(self.keys), 8), dtype=np.float32)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_empty_store(self):
+        store = EmbeddingStore(self.directory.name)
+        self.assertEqual(len(store), 0)
+        self.assertNotIn(self.keys[0], store)
+        self.assertEqual(store.matrix.shape, (0, 0))
+
+    def test_add_and_reopen(self):
+        store = EmbeddingStore(self.directory.name)
+        store.add(self.keys[:10], self.embeddings[:10])
+        store.add(self.keys[5:], self.embeddings[5:])  # keys 5-9 are already stored
+        self.assertEqual(len(store), len(self.keys))
+
+        reopened = EmbeddingStore(self.directory.name)
+        self.assertEqual(reopened.index, store.index)
+        np.testing.assert_array_equal(reopened.matrix, self.embeddings)
+        np.testing.assert_array_equal(reopened.get(self.keys[::-2]), self.embeddings[::-2])
+
+    def test_consecutive_rows_are_a_view(self):
+        store = EmbeddingStore(self.directory.name, dtype="float16")
+        store.add(self.keys, self.embeddings)
+        embeddings = store.get(self.keys[3:7])
+        self.assertIsInstance(embeddings, np.memmap)
+        self.assertEqual(embeddings.dtype, np.float16)
+        np.testing.assert_array_equal(embeddings, self.embeddings[3:7].astype(np.float16))
+
+    def test_int8_store(self):
+        store = EmbeddingStore(self.directory.name, dtype="int8")
+        store.add(self.keys[:4], self.embeddings[:4])
+        store.add(self.keys[4:], self.embeddings[4:])
+
+        reopened = EmbeddingStore(self.directory.name, dtype="float32")  # keeps its dtype
+        self.assertEqual(reopened.dtype, np.int8)
+        values, scales = reopened.get_quantized(self.keys)
+        self.assertEqual((values.dtype, scales.dtype), (np.int8, np.float32))
+        np.testing.assert_array_equal(reopened.get(self.keys), dequantize(values, scales))
+        np.testing.assert_allclose(reopened.get(self.keys[::-1]), self.embeddings[::-1], atol=1 / 127)
+
+    def test_corrupted_store_is_rejected(self):
+        store = EmbeddingStore(self.directory.name)
+        store.add(self.keys[:4], self.embeddings[:4])
+        with open(store.path("keys"), 'a', encoding='utf-8') as keys_f:
+            keys_f.write(f"{self.keys[0]}\n")
+        with self.assertRaises(ValueError):  # duplicate key
+            EmbeddingStore(self.directory.name)
+
+        with open(store.path("keys"), 'w', encoding='utf-8') as keys_f:
+            keys_f.write("".join(f"{key}\n" for key in self.keys[:5]))
+        with self.assertRaises(ValueError):  # key without its row
+            EmbeddingStore(self.directory.name)
+
+        store.index[self.keys[3]] = 4  # past the 4 rows of the matrix
+        with self.assertRaises(IndexError):
+            store.get_quantized(self.keys[2:4])
+
+    def test_single_writer(self):
+        store = EmbeddingStore(self.directory.name)
+        other = EmbeddingStore(self.directory.name)
+        store.add(self.keys[:4], self.embeddings[:4])
+        with self.assertRaises(RuntimeError):  # would write over the rows of store
+            other.add(self.keys[4:], self.embeddings[4:])
+
+        store.pid = -1  # as a copy of the store in another process
+        with self.assertRaises(RuntimeError):
+            store.add(self.keys[4:], self.embeddings[4:])
+        np.testing.assert_array_equal(EmbeddingStore(self.directory.name).matrix, self.embeddings[:4])
+
+    def test_quantize(self):
+        values, scales = quantize(np.array([[0.5, -1.0, 0.25], [0, 0, 0]], dtype=np.float32), "int8")
+        self.assertEqual(values.tolist(), [[64, -127, 32], [0, 0, 0]])
+        self.assertEqual(dequantize(values, scales)[1].tolist(), [0, 0, 0])
+        values, scales = quantize(self.embeddings, "float16")
+        self.assertEqual(values.dtype, np.float16)
+        self.assertIsNone(scales)
+
+
+if __name__ == '__main__':
+    unittest.main()
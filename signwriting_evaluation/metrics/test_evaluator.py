@@ -0,0 +1,57 @@
+import unittest
+
+import numpy as np
+from signwriting.formats.fsw_to_swu import fsw2swu
+
+from signwriting_evaluation.metrics.bleu import SignWritingBLEU
+from signwriting_evaluation.metrics.chrf import SignWritingCHRF
+from signwriting_evaluation.metrics.evaluator import MultiMetricEvaluator
+from signwriting_evaluation.metrics.parsed import parse_signwriting
+from signwriting_evaluation.metrics.similarity import SignWritingSimilarityMetric
+
+
+class TestMultiMetricEvaluator(unittest.TestCase):
+    def setUp(self):
+        self.metrics = [SignWritingSimilarityMetric(), SignWritingBLEU(), SignWritingCHRF()]
+        self.evaluator = MultiMetricEvaluator(self.metrics)
+        signs = [
+            "M530x538S37602508x462S15a11493x494S20e00488x510S22f03469x517",
+            "M519x534S37900497x466S3770b497x485S15a51491x501S22f03481x513",
+            "M508x515S10000492x485",
+        ]
+        self.texts = signs + [f"{signs[0]} {signs[2]}", signs[1], signs[0]]  # with duplicates
+
+    def test_score_all_matches_each_metric(self):
+        hypotheses = self.texts + [parse_signwriting(self.texts[3])]
+        results = self.evaluator.score_all(hypotheses, self.texts)
+        self.assertEqual(list(results), [metric.name for metric in self.metrics])
+        for metric in self.metrics:
+            expected = np.array(metric.score_all(hypotheses, self.texts))
+            np.testing.assert_array_equal(results[metric.name], expected, err_msg=metric.name)
+
+    def test_corpus_score_matches_each_metric(self):
+        references = [self.texts[::-1], self.texts[1:] + self.texts[:1]]
+        results = self.evaluator.corpus_score(self.texts, references)
+        for metric in self.metrics:
+            self.assertEqual(results[metric.name], metric.corpus_score(self.texts, references), msg=metric.name)
+
+    def test_swu_scores_match_each_metric(self):
+        # Sharing the parsed texts does not change the scores of metrics that work on strings
+        texts = [fsw2swu(text) for text in self.texts]
+        results = self.evaluator.score_all(texts, texts[::-1], progress_bar=False)
+        for metric in [SignWritingBLEU(), SignWritingCHRF()]:
+            expected = [[metric.score(hypothesis, reference) for reference in texts[::-1]] for hypothesis in texts]
+            np.testing.assert_array_equal(results[metric.name], expected, err_msg=metric.name)
+
+        references = [texts[::-1]]
+        results = self.evaluator.corpus_score(texts, references)
+        for metric in [SignWritingBLEU(), SignWritingCHRF()]:
+            self.assertEqual(results[metric.name], metric.corpus_score(texts, references), msg=metric.name)
+
+    def test_distinct_names(self):
+        with self.assertRaises(AssertionError):
+            MultiMetricEvaluator([SignWritingBLEU(), SignWritingBLEU()])
+
+
+if __name__ == '__main__':
+    unittest.main()
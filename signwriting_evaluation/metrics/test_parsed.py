@@ -0,0 +1,43 @@
+import unittest
+from pathlib import Path
+
+from signwriting_evaluation.metrics.bleu import SignWritingBLEU
+from signwriting_evaluation.metrics.chrf import SignWritingCHRF
+from signwriting_evaluation.metrics.parsed import parse_signwriting
+from signwriting_evaluation.metrics.similarity import SignWritingSimilarityMetric
+
+ASSETS_DIR = Path(__file__).parent.parent.parent / "assets"
+
+
+class TestParsedSignWriting(unittest.TestCase):
+    def setUp(self):
+        with open(ASSETS_DIR / "hello_signs.txt", 'r', encoding='utf-8') as signs_f:
+            self.signs = signs_f.read().splitlines()[:20]
+        self.sentence = "M530x538S37602508x462S15a11493x494 M519x534S37900497x466S3770b497x485S15a51491x501"
+
+    def test_parse(self):
+        parsed = parse_signwriting(self.sentence)
+        self.assertEqual(parsed.num_signs, 2)
+        self.assertEqual(parsed.boxes, "MM")
+        self.assertEqual(parsed.sign_offsets.tolist(), [0, 2, 5])
+        self.assertEqual(parsed.symbols[0], 0x37602)
+        self.assertEqual(parsed.positions[0].tolist(), [508, 462])
+        self.assertEqual(str(parsed), self.sentence)
+        symbols, positions = parsed.sign_symbols(1)
+        self.assertEqual(symbols.tolist(), [0x37900, 0x3770b, 0x15a51])
+        self.assertEqual(positions.tolist(), [[497, 466], [497, 485], [491, 501]])
+
+    def test_metrics_accept_parsed_input(self):
+        parsed = [parse_signwriting(text) for text in self.signs]
+        for metric in [SignWritingSimilarityMetric(), SignWritingBLEU(), SignWritingCHRF()]:
+            for hypothesis, reference in zip(self.signs + [self.sentence], self.signs[1:] + [self.signs[0]]):
+                self.assertEqual(metric.score(parse_signwriting(hypothesis), parse_signwriting(reference)),
+                                 metric.score(hypothesis, reference))
+            self.assertEqual(metric.score_all(parsed, parsed, progress_bar=False),
+                             metric.score_all(self.signs, self.signs, progress_bar=False))
+            self.assertEqual(metric.corpus_score(parsed, [parsed[::-1]]),
+                             metric.corpus_score(self.signs, [self.signs[::-1]]))
+
+
+if __name__ == '__main__':
+    unittest.main()
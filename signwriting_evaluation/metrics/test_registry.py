@@ -0,0 +1,49 @@
+import json
+import subprocess
+import sys
+import unittest
+
+from signwriting_evaluation.metrics.registry import get_metric
+
+# Modules the light metrics (and the evaluation scripts, when imported) must not import
+HEAVY_MODULES = ["torch", "transformers", "diskcache", "matplotlib", "PIL"]
+IMPORT_TIME_LIMIT = 5  # seconds, to import and construct all light metrics in a fresh process
+
+LIGHT_METRICS_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+from signwriting_evaluation.metrics.registry import get_metric
+import signwriting_evaluation.evaluation.closest_matches
+metrics = [get_metric(name) for name in ["bleu", "chrf", "similarity"]]
+elapsed = time.perf_counter() - start
+print(json.dumps({"elapsed": elapsed, "modules": sorted(sys.modules)}))
+"""
+
+
+class TestRegistry(unittest.TestCase):
+    def test_get_metric(self):
+        fsw = "M530x538S37602508x462S15a11493x494S20e00488x510S22f03469x517"
+        for name, metric_name in [("bleu", "TokenizedBLEU"), ("chrf", "CHRF"), ("similarity", "SymbolsDistances")]:
+            metric = get_metric(name)
+            self.assertEqual(metric.name, metric_name)
+            self.assertAlmostEqual(metric.score(fsw, fsw), 1)
+
+    def test_get_metric_arguments(self):
+        metric = get_metric("similarity", cache_size=1)
+        self.assertEqual(metric.cache_info()["text_to_signs_attributes"].maxsize, 1)
+
+    def test_unknown_metric(self):
+        with self.assertRaises(ValueError):
+            get_metric("unknown")
+
+    def test_light_metrics_do_not_import_heavy_modules(self):
+        output = subprocess.run([sys.executable, "-c", LIGHT_METRICS_SCRIPT],
+                                capture_output=True, text=True, check=True).stdout
+        result = json.loads(output)
+        imported = {module.split(".")[0] for module in result["modules"]}
+        self.assertEqual(imported & set(HEAVY_MODULES), set())
+        self.assertLess(result["elapsed"], IMPORT_TIME_LIMIT)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import pickle
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+from signwriting_evaluation.metrics.base import SignWritingMetric
+from signwriting_evaluation.metrics.chrf import SignWritingCHRF
+from signwriting_evaluation.metrics.score_cache import CachedScoresMetric, PairScoreCache
+from signwriting_evaluation.metrics.similarity import SignWritingSimilarityMetric
+
+
+class CountingLengthRatioMetric(SignWritingMetric):
+    SYMMETRIC = True
+
+    def __init__(self):
+        super().__init__(name="LengthRatio")
+        self.scored_pairs = 0
+
+    def score(self, hypothesis: str, reference: str) -> float:
+        self.scored_pairs += 1
+        return min(len(hypothesis), len(reference)) / max(len(hypothesis), len(reference))
+
+
+class NewerLengthRatioMetric(CountingLengthRatioMetric):
+    VERSION = 2
+
+
+class TestCachedScoresMetric(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.path = Path(self.directory.name) / "scores.sqlite"
+        self.texts = ["M500x500", "M500x500S10000", "M500x500S10000S20000", "M518x529S14c20481x471", "S1"]
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_scores_are_persisted(self):
+        metric = CountingLengthRatioMetric()
+        cached = CachedScoresMetric(metric, self.path)
+        expected = metric.score_all(self.texts, self.texts[:3], progress_bar=False)
+        metric.scored_pairs = 0
+        self.assertEqual(cached.score_all(self.texts * 2, self.texts[:3], progress_bar=False), expected * 2)
+        # Distinct texts are scored once, and symmetric pairs are stored once
+        self.assertEqual(metric.scored_pairs, 15)
+        self.assertEqual(len(cached.score_cache), 12)
+        cached.score_cache.close()
+
+        # Another run only scores the missing pairs
+        metric = CountingLengthRatioMetric()
+        cached = CachedScoresMetric(metric, self.path)
+        cached.enable_instrumentation()
+        scores = cached.score_all(self.texts[:3], self.texts + ["M500x500S30000"], progress_bar=False)
+        self.assertEqual([row[:-1] for row in scores], [list(row) for row in zip(*expected)])
+        self.assertEqual(metric.scored_pairs, 3)  # against the new text
+        self.assertEqual(cached.instrumentation_report()["caches"]["scores"]["hits"], 12)
+
+        # Scores are sent to worker processes with the cache, which they open again
+        restored = pickle.loads(pickle.dumps(cached))
+        self.assertEqual(restored.score(self.texts[4], self.texts[4]), 1)
+        self.assertEqual(len(restored.score_cache), 16)
+
+    def test_configurations_are_kept_apart(self):
+        CachedScoresMetric(CountingLengthRatioMetric(), self.path).score_all(self.texts, self.texts,
+                                                                             progress_bar=False)
+        metric = NewerLengthRatioMetric()
+        self.assertNotEqual(metric.configuration_hash(), CountingLengthRatioMetric().configuration_hash())
+        CachedScoresMetric(metric, self.path).score_all(self.texts, self.texts, progress_bar=False)
+        self.assertEqual(metric.scored_pairs, 25)
+
+    def test_similarity(self):
+        metric = SignWritingSimilarityMetric()
+        cached = CachedScoresMetric(metric, PairScoreCache(self.path))
+        np.testing.assert_allclose(cached.score_self(self.texts, progress_bar=False, as_array=True),
+                                   metric.score_self(self.texts, progress_bar=False, as_array=True))
+
+        references = [self.texts[::-1], self.texts[1:] + self.texts[:1]]
+        self.assertAlmostEqual(cached.corpus_score(self.texts, references),
+                               metric.corpus_score(self.texts, references))
+
+    def test_corpus_statistics_are_not_cached(self):
+        metric = SignWritingCHRF()
+        cached = CachedScoresMetric(metric, self.path)
+        references = [self.texts[::-1]]
+        self.assertEqual(cached.corpus_score(self.texts, references), metric.corpus_score(self.texts, references))
+        self.assertEqual(len(cached.score_cache), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
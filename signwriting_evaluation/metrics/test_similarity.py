@@ -1,9 +1,17 @@
 import unittest
 
-from signwriting_evaluation.metrics.similarity import SignWritingSimilarityMetric
+import numpy as np
+from scipy.optimize import linear_sum_assignment
 
+from signwriting.formats.fsw_to_sign import fsw_to_sign
+from signwriting.formats.fsw_to_swu import fsw2swu
 
-class TestSignWritingSymbolDistance(unittest.TestCase):
+from signwriting_evaluation.metrics.parsed import parse_signwriting
+from signwriting_evaluation.metrics.similarity import SignWritingSimilarityMetric, get_sign_attributes, \
+    get_shape_class_index, length_weight, text_to_signs, SYMBOL_CLASSES
+
+
+class TestSignWritingSymbolDistance(unittest.TestCase):  # pylint: disable=too-many-public-methods
     def setUp(self):
         self.metric = SignWritingSimilarityMetric()
 
@@ -59,6 +67,20 @@ class TestSignWritingSymbolDistance(unittest.TestCase):
         score = self.metric.score(hypothesis, reference)
         self.assertAlmostEqual(score, 1)
 
+    def test_multi_sign_score_matches_padded_score_all(self):
+        signs = ["M530x538S17600508x462S15a11493x494S20e00488x510S22f03469x517",
+                 "M530x538S17600508x462S12a11493x494S20e00488x510S22f13469x517",
+                 "M519x534S37900497x466S3770b497x485S15a51491x501S22f03481x513",
+                 "M520x520S14c20480x484S27106505x480"]
+        hypothesis_signs = signs + [signs[0]]
+        reference_signs = [signs[1], signs[3], signs[1]]
+        cost_matrix = np.array(self.metric.score_all(hypothesis_signs, reference_signs + [None, None],
+                                                     progress_bar=False))
+        row_ind, col_ind = linear_sum_assignment(1 - cost_matrix)
+        score = self.metric.score(" ".join(hypothesis_signs), " ".join(reference_signs))
+        self.assertEqual(score, cost_matrix[row_ind, col_ind].mean())
+        self.assertEqual(score, self.metric.score(" ".join(reference_signs), " ".join(hypothesis_signs)))
+
     def test_bad_fsw_equals_0(self):
         bad_fsw = "M<s><s>M<s>p483"
         score = self.metric.corpus_score([bad_fsw], [[bad_fsw]])
@@ -72,6 +94,18 @@ class TestSignWritingSymbolDistance(unittest.TestCase):
         self.assertIsInstance(score, float)  # Check if the score is a float
         self.assertAlmostEqual(score, 0.5557001288803375)
 
+    def test_text_to_signs(self):
+        fsw = "M530x538S17600508x462 M519x534S37900497x466S3770b497x485"
+        self.assertEqual(text_to_signs(fsw), ("M530x538S17600508x462", "M519x534S37900497x466S3770b497x485"))
+        self.assertEqual(text_to_signs(fsw2swu(fsw)), text_to_signs(fsw))
+
+    def test_length_weight(self):
+        hyp = fsw_to_sign("M530x538S17600508x462S15a11493x494S20e00488x510")
+        ref = fsw_to_sign("M530x538S17600508x462")
+        self.assertEqual(self.metric.length_acc(hyp, ref), 2 / 4)
+        self.assertEqual(length_weight(3, 1), pow(2 / 4, 1.5))
+        np.testing.assert_array_equal(length_weight(3, np.arange(6)), [length_weight(3, n) for n in range(6)])
+
     def test_unknown_symbol_class_returns_zero_score(self):
         # Test that symbols with shapes outside defined class ranges are handled gracefully
         # When a symbol's shape doesn't match any defined symbol class ranges, the metric
@@ -81,6 +115,87 @@ class TestSignWritingSymbolDistance(unittest.TestCase):
         score = self.metric.score(hypothesis, reference)
         self.assertEqual(score, 0)
 
+    def test_cost_matrix_matches_symbols_score(self):
+        hyp = fsw_to_sign("M530x538S37602508x462S15a11493x494S20e00488x510S22f03469x517S38c00508x462")
+        ref = fsw_to_sign("M519x534S37900497x466S3770b497x485S15a51491x501S22f03481x513")
+        cost_matrix = self.metric.cost_matrix(get_sign_attributes(hyp), get_sign_attributes(ref))
+        expected = [[self.metric.symbols_score(h, r) for r in ref["symbols"]] for h in hyp["symbols"]]
+        self.assertEqual(cost_matrix.tolist(), expected)
+
+    def test_score_all_matches_score(self):
+        signs = [
+            "M530x538S37602508x462S15a11493x494S20e00488x510S22f03469x517",
+            "M519x534S37900497x466S3770b497x485S15a51491x501S22f03481x513",
+            "M530x538S17600508x462S12a11493x494S20e00488x510S22f13469x517",
+            "M530x538S17600508x462",
+            "M530x538S38c00508x462",
+            "M530x538S17600508x462 M530x538S37602508x462S15a11493x494",
+            None,
+        ]
+        scores = self.metric.score_all(signs, signs[:-1], progress_bar=False)
+        expected = [[self.metric.score(hypothesis, reference) for reference in signs[:-1]] for hypothesis in signs]
+        self.assertEqual(scores, expected)
+
+    def test_score_all_as_array(self):
+        signs = ["M530x538S37602508x462S15a11493x494S20e00488x510S22f03469x517", "M530x538S17600508x462"]
+        scores = self.metric.score_all(signs, signs, progress_bar=False, as_array=True)
+        self.assertIsInstance(scores, np.ndarray)
+        self.assertEqual(scores.shape, (2, 2))
+        self.assertEqual(scores.tolist(), self.metric.score_all(signs, signs, progress_bar=False))
+
+    def test_parsed_texts_are_encoded_once(self):
+        signs = ["M530x538S17600508x462S15a11493x494S20e00488x510S22f03469x517",
+                 "M530x538S17600508x462S12a11493x494S20e00488x510S22f13469x517",
+                 "M519x534S37900497x466S3770b497x485S15a51491x501S22f03481x513"]
+        texts = [" ".join(signs), " ".join(signs[:2]), " ".join(signs[::-1]), signs[2]]
+        parsed = [parse_signwriting(text) for text in texts]
+        self.metric.enable_instrumentation()
+        scores = self.metric.score_all(parsed, parsed[::-1], progress_bar=False, deduplicate=False)
+        self.assertEqual(self.metric.instrumentation_report()["counters"]["parsed_encodings"], 2 * len(parsed))
+        self.assertEqual(scores, self.metric.score_all(texts, texts[::-1], progress_bar=False))
+
+    def test_top_k_matches_exhaustive_search(self):
+        corpus = [
+            "M530x538S37602508x462S15a11493x494S20e00488x510S22f03469x517",
+            "M519x534S37900497x466S3770b497x485S15a51491x501S22f03481x513",
+            "M530x538S17600508x462S12a11493x494S20e00488x510S22f13469x517",
+            "M530x538S17600508x462S15a11493x494S20e00488x510S22f03469x517",
+            "M530x538S17600508x462",
+            "M530x538S38c00508x462",
+            "M530x538S30a00482x482S33e00482x482",
+            "M530x538S17600508x462 M530x538S37602508x462S15a11493x494",
+            "M500x500",
+        ]
+        queries = corpus[:3] + ["M530x538S30a00482x482", corpus[-2]]
+        indices, scores = self.metric.top_k(queries, corpus, k=3, progress_bar=False)
+        all_scores = self.metric.score_all(queries, corpus, progress_bar=False)
+        for query_indices, query_scores, row in zip(indices, scores, all_scores):
+            expected = sorted(range(len(row)), key=row.__getitem__, reverse=True)[:3]
+            self.assertEqual(query_indices, expected)
+            self.assertEqual(query_scores, [row[j] for j in expected])
+
+        self.assertEqual(self.metric.top_k(queries, corpus, k=0, progress_bar=False), ([[]] * 5, [[]] * 5))
+
+    def test_shape_class_index(self):
+        for class_index, shapes in enumerate(SYMBOL_CLASSES.values()):
+            self.assertEqual(get_shape_class_index(shapes.start), class_index)
+            self.assertEqual(get_shape_class_index(shapes.stop - 1), class_index)
+        self.assertIsNone(get_shape_class_index(0x38c))
+        self.assertIsNone(get_shape_class_index(0x3ff))
+
+    def test_caches(self):
+        metric = SignWritingSimilarityMetric(cache_size=1)
+        hypothesis = "M530x538S37602508x462S15a11493x494S20e00488x510S22f03469x517"
+        reference = "M519x534S37900497x466S3770b497x485S15a51491x501S22f03481x513"
+        metric.score(hypothesis, reference)
+        metric.score(hypothesis, reference)
+        info = metric.cache_info()["text_to_signs_attributes"]
+        self.assertEqual((info.hits, info.misses, info.maxsize, info.currsize), (0, 4, 1, 1))
+
+        with metric.scoped_caches():
+            metric.score(hypothesis, hypothesis)
+        self.assertEqual(metric.cache_info()["text_to_signs_attributes"].currsize, 0)
+
 
 if __name__ == '__main__':
     unittest.main()